@@ -12,6 +12,9 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "replace‐me")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+# Users whose record has role "staff" (support desk, gate system) get it as a
+# token claim and may see and cancel any account's bookings
+STAFF_ROLE = "staff"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
@@ -36,10 +39,11 @@ def decode_access_token(token: str) -> dict | None:
     except JWTError:
         return None
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
     """
     FastAPI dependency that returns the 'sub' claim from a valid JWT,
-    raising 401 on missing/invalid/expired.
+    raising 401 on missing/invalid/expired. Async so that booking routes
+    run entirely on the event loop without a threadpool hop.
     """
     if not token:
         raise HTTPException(
@@ -54,4 +58,12 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return payload["sub"]
\ No newline at end of file
+    return payload["sub"]
+
+async def is_staff(token: str = Depends(oauth2_scheme)) -> bool:
+    """
+    FastAPI dependency: whether the caller's token carries the staff role.
+    Use alongside get_current_user, which rejects missing or bad tokens.
+    """
+    payload = decode_access_token(token) if token else None
+    return bool(payload) and payload.get("role") == STAFF_ROLE
@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
+from starlette.concurrency import run_in_threadpool
 from utils.mongo import get_db
 from auth.auth_utils import hash_password, verify_password, create_access_token, decode_access_token
 from models.schemas import UserRegister, UserLogin, TokenResponse, UserProfile, SimpleMessage
+from services.admission import admission
+from services.profiles import profiles
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -18,27 +21,32 @@ def get_current_email(token: str = Depends(oauth2_scheme)) -> str:
         raise HTTPException(401, "Invalid credentials")
     return payload["sub"]
 
-@router.post("/register", response_model=SimpleMessage)
+# bcrypt runs in the threadpool so hashing never stalls the event loop;
+# the "auth" admission class caps how many hashes run at once
+@router.post("/register", response_model=SimpleMessage, dependencies=[Depends(admission.limit("auth"))])
 async def register(user: UserRegister):
     db = get_db()
     if await db["users"].find_one({"email": user.email}):
         raise HTTPException(400, "User exists")
-    hashed = hash_password(user.password)
+    hashed = await run_in_threadpool(hash_password, user.password)
     await db["users"].insert_one({"email": user.email, "hashed_password": hashed, "loyaltyPoints": 0})
+    profiles.invalidate(user.email)
     return SimpleMessage(message="Registered")
 
-@router.post("/login", response_model=TokenResponse)
+@router.post("/login", response_model=TokenResponse, dependencies=[Depends(admission.limit("auth"))])
 async def login(user: UserLogin):
     db = get_db()
     rec = await db["users"].find_one({"email": user.email})
-    if not rec or not verify_password(user.password, rec["hashed_password"]):
+    if not rec or not await run_in_threadpool(verify_password, user.password, rec["hashed_password"]):
         raise HTTPException(400, "Bad email or password")
-    token = create_access_token({"sub": user.email})
+    claims = {"sub": user.email}
+    if rec.get("role"):
+        claims["role"] = rec["role"]
+    token = create_access_token(claims)
     return TokenResponse(access_token=token)
 
+# Served from the profile cache; includes points not yet flushed to Mongo
 @router.get("/me", response_model=UserProfile)
 async def me(email: str = Depends(get_current_email)):
-    db = get_db()
-    rec = await db["users"].find_one({"email": email})
-    pts = rec.get("loyaltyPoints", 0) if rec else 0
+    pts = await profiles.loyalty_points(email)
     return UserProfile(userId=email, loyaltyPoints=pts)
\ No newline at end of file
@@ -1,18 +1,22 @@
+import asyncio
+import json
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
 
 from dotenv import load_dotenv
 import stripe
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # 1) Load .env + Stripe
 load_dotenv()
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 
 # 2) Auth dependency
-from auth.auth_utils import get_current_user
+from auth.auth_utils import get_current_user, is_staff
 
 # 3) Routers
 from auth.routes               import router as auth_router
@@ -21,17 +25,40 @@ from routes.subscriptions      import router as subscriptions_router
 from routes.subscribers_list   import router as subscribers_router
 
 # 4) Booking service & schemas
-from services.booking_service import service, BookingError
+from services.booking_service import BookingError, BookingNotFound
+from services.allocator import Rule
+from services.lots import lots, LotShard, LotNotFound, LotElsewhere
+from services.admission import admission
+from services.idempotency import IdempotencyMiddleware
+from services.lot_proxy import LotProxyMiddleware, close_client as close_lot_proxy
+from services.profiles import profiles, LOYALTY_POINTS_PER_BOOKING
+from services.notifications import notifier, callback_allowed
+from services.qr_tokens import verify_batch
+from services.shared_state import SharedStateUnavailable
 from models.schemas import (
     BookingRequest,
+    RecurringBookingRequest,
+    RecurringSlotResponse,
     CancelRequest,
     SlotResponse,
     SimpleMessage,
+    BookingInfo,
+    BookingList,
     SlotOnly,
     SlotOccupiedStatus,
     OccupancyStatus,
     FreeSlotsStatus,
+    GateVerifyRequest,
+    GateVerdict,
+    GateVerifyResponse,
+    LotInfo,
+    LotList,
+    WaitlistRequest,
+    WaitlistEntryInfo,
+    WaitlistResponse,
+    WaitlistList,
 )
+from utils.mongo import get_db
 
 app = FastAPI(
     title="Park & Ride API",
@@ -39,7 +66,11 @@ app = FastAPI(
     version="1.0",
 )
 
-# 5) CORS (dev-open)
+# 5) Idempotency-Key replay for /book, /cancel, /waitlist and /payments/create-intent,
+#    forwarding of requests for lots other processes own, then CORS
+#    (dev-open) around everything
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(LotProxyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -60,49 +91,310 @@ app.include_router(
 )
 
 # 7) Booking endpoints (protected)
-@app.post("/book", response_model=SlotResponse)
-def book(req: BookingRequest, user: str = Depends(get_current_user)):
+
+# Every booking endpoint takes an optional ?lot_id= (default lot when
+# omitted). Each lot is its own shard; LotProxyMiddleware forwards requests
+# for lots owned by another process, so a remote lot only gets here when a
+# forwarded request arrives at a process that does not own it either.
+def get_shard(lot_id: Optional[str] = None) -> LotShard:
+    try:
+        return lots.shard(lot_id)
+    except LotNotFound:
+        raise HTTPException(status_code=404, detail=f"Unknown lot: {lot_id}")
+    except LotElsewhere as e:
+        raise HTTPException(status_code=502, detail=f"{e}, but this request was already forwarded once")
+
+# With BOOKING_SHARED_STATE=reader this worker is a read replica: occupancy
+# reads come from the writer's shared-memory segment and everything that
+# needs full reservation state is refused.
+async def require_writer(shard: LotShard = Depends(get_shard)):
+    if shard.shared_reader is not None:
+        raise HTTPException(status_code=503, detail="Read-only replica; send this request to the writer")
+
+@app.exception_handler(SharedStateUnavailable)
+async def shared_state_unavailable(request: Request, exc: SharedStateUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.get("/lots", response_model=LotList)
+async def list_lots():
+    return LotList(default=lots.default, lots=[
+        LotInfo(lot_id=cfg.lot_id, rows=cfg.rows, cols=cfg.cols, total=cfg.rows * cfg.cols,
+                local=cfg.lot_id in lots.shards, url=cfg.url)
+        for cfg in lots.configs.values()
+    ])
+
+# Mutations go through the lot's single-writer engine; reads use its latest
+# immutable snapshot and never touch the live service. Mutations and scans
+# are admission-controlled (429 + Retry-After when a client floods them).
+# Bookings earn the caller loyalty points and cancellations take them back
+# from the booking's owner, through the buffered profile service. Every
+# reservation records the account that made it; only that account can
+# list or cancel it, and anyone else gets a 404.
+@app.post("/book", response_model=SlotResponse, dependencies=[Depends(require_writer),
+          Depends(admission.limit("book"))])
+async def book(req: BookingRequest, shard: LotShard = Depends(get_shard),
+               user: str = Depends(get_current_user)):
     try:
-        slot, start_dt, end_dt, qr = service.book(
-            req.start, req.hours, req.days, req.months, req.plate
+        slot, start_dt, end_dt, qr = await shard.engine.book(
+            req.start, req.hours, req.days, req.months, req.plate, user
         )
+        profiles.accrue(user, LOYALTY_POINTS_PER_BOOKING)
         return SlotResponse(
             slot={"row": slot[0], "col": slot[1]},
             start=start_dt,
             end=end_dt,
             qr=qr,
+            booking_id=shard.snapshot.booking_id(slot[0], slot[1], start_dt, end_dt),
+            lot_id=shard.lot_id,
         )
     except BookingError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/cancel", response_model=SimpleMessage)
-def cancel(req: CancelRequest, user: str = Depends(get_current_user)):
+# Recurring schedules (e.g. weekdays 08:00-18:00 for six months) are one
+# rule on one slot, expanded only when occupancy or conflicts are checked
+@app.post("/book/recurring", response_model=RecurringSlotResponse, dependencies=[Depends(require_writer),
+          Depends(admission.limit("book"))])
+async def book_recurring(req: RecurringBookingRequest, shard: LotShard = Depends(get_shard),
+                         user: str = Depends(get_current_user)):
     try:
-        service.cancel(req.row, req.col, req.start, req.end, req.plate)
+        slot, rule, qr = await shard.engine.book_recurring(
+            req.start, req.hours, req.weekdays, req.until, req.plate, user, req.tz
+        )
+        profiles.accrue(user, LOYALTY_POINTS_PER_BOOKING)
+        return RecurringSlotResponse(
+            slot={"row": slot[0], "col": slot[1]},
+            start=rule.start,
+            end=rule.end,
+            qr=qr,
+            booking_id=shard.snapshot.booking_id(slot[0], slot[1], rule.start, rule.end),
+            lot_id=shard.lot_id,
+            hours=req.hours,
+            weekdays=_weekdays(rule),
+            tz=rule.tz,
+        )
+    except BookingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _debit_points(booking) -> None:
+    # Only owned bookings earned points; older ones have no owner to debit
+    if booking.owner:
+        profiles.accrue(booking.owner, -LOYALTY_POINTS_PER_BOOKING)
+
+def _scope(user: str, staff: bool):
+    """Owner to filter bookings by: the caller, or None (every account) for staff."""
+    return None if staff else user
+
+def _weekdays(rule: Rule):
+    return [d for d in range(7) if rule.weekdays >> d & 1]
+
+def _schedule(b) -> dict:
+    """hours/weekdays/tz of a recurring rule (live or read from the journal), else {}."""
+    if not isinstance(b, Rule):
+        return {}
+    return {"hours": int(b.duration.total_seconds()) // 3600, "weekdays": _weekdays(b), "tz": b.tz}
+
+@app.post("/cancel", response_model=SimpleMessage, dependencies=[Depends(require_writer),
+          Depends(admission.limit("book"))])
+async def cancel(req: CancelRequest, shard: LotShard = Depends(get_shard),
+                 user: str = Depends(get_current_user), staff: bool = Depends(is_staff)):
+    try:
+        _debit_points(await shard.engine.cancel(req.row, req.col, req.start, req.end, req.plate,
+                                                _scope(user, staff)))
         return SimpleMessage(message="Cancelled successfully")
+    except BookingNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except BookingError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/bookings", response_model=BookingList, dependencies=[Depends(require_writer)])
+def bookings(plate: str, include_archived: bool = False, shard: LotShard = Depends(get_shard),
+             user: str = Depends(get_current_user), staff: bool = Depends(is_staff)):
+    snap, owner = shard.snapshot, _scope(user, staff)
+    found = snap.bookings_for_plate(plate, owner)
+    if include_archived:
+        found = shard.service.archived_for_plate(plate, owner) + found
+    return BookingList(bookings=[
+        BookingInfo(
+            booking_id=snap.booking_id(r, c, b.start, b.end),
+            slot={"row": r, "col": c},
+            start=b.start,
+            end=b.end,
+            plate=b.plate,
+            **_schedule(b),
+        )
+        for (r, c), b in found
+    ])
+
+@app.delete("/bookings/{booking_id}", response_model=SimpleMessage, dependencies=[Depends(require_writer),
+          Depends(admission.limit("book"))])
+async def cancel_booking(booking_id: str, shard: LotShard = Depends(get_shard),
+                         user: str = Depends(get_current_user), staff: bool = Depends(is_staff)):
+    try:
+        _debit_points(await shard.engine.cancel_by_id(booking_id, _scope(user, staff)))
+        return SimpleMessage(message="Cancelled successfully")
+    except BookingNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except BookingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _cached_read(request: Request, response: Response, shard: LotShard,
+                 endpoint: str, params, at: datetime, compute):
+    """
+    Serve a snapshot read from the lot's response cache, keyed by
+    (endpoint, params, time bucket, state version). compute(snapshot,
+    bucket_start) builds the response on a miss. Matching If-None-Match
+    gets a 304.
+    """
+    snap, cache = shard.view, shard.cache
+    key = cache.key(endpoint, params, at, snap.version)
+    etag = cache.etag(key)
+    if cache.not_modified(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    body = cache.get(key)
+    if body is None:
+        body = compute(snap, cache.bucket(at))
+        cache.put(key, body)
+    response.headers["ETag"] = etag
+    return body
+
 @app.get("/occupancy", response_model=OccupancyStatus)
-def occupancy(at: datetime, user: str = Depends(get_current_user)):
-    occupied = service.occupancy_at(at)
-    return OccupancyStatus(occupied=occupied, total=service.TOTAL)
+async def occupancy(at: datetime, request: Request, response: Response,
+                    shard: LotShard = Depends(get_shard), user: str = Depends(get_current_user)):
+    return _cached_read(
+        request, response, shard, "occupancy", None, at,
+        lambda snap, t: OccupancyStatus(occupied=snap.occupancy_at(t), total=snap.TOTAL),
+    )
 
 @app.get("/slot-occupied", response_model=SlotOccupiedStatus)
-def slot_occupied(slot: str, at: datetime, user: str = Depends(get_current_user)):
-    return SlotOccupiedStatus(occupied=service.is_slot_occupied(slot, at))
+async def slot_occupied(slot: str, at: datetime, request: Request, response: Response,
+                        shard: LotShard = Depends(get_shard), user: str = Depends(get_current_user)):
+    return _cached_read(
+        request, response, shard, "slot-occupied", slot, at,
+        lambda snap, t: SlotOccupiedStatus(occupied=snap.is_slot_occupied(slot, t)),
+    )
 
-@app.post("/find-slot", response_model=SlotOnly)
-def find_slot(start: datetime, end: datetime, user: str = Depends(get_current_user)):
-    s = service.find_slot(start, end)
+@app.post("/find-slot", response_model=SlotOnly, dependencies=[Depends(require_writer),
+          Depends(admission.limit("search"))])
+async def find_slot(start: datetime, end: datetime, shard: LotShard = Depends(get_shard),
+                    user: str = Depends(get_current_user)):
+    s = shard.snapshot.find_slot(start, end)
     if not s:
         raise HTTPException(status_code=404, detail="No available slot")
     return SlotOnly(slot={"row": s[0], "col": s[1]})
 
 @app.get("/free-slots", response_model=FreeSlotsStatus)
-def free_slots(at: datetime, user: str = Depends(get_current_user)):
-    occ = service.occupancy_at(at)
-    return FreeSlotsStatus(free=service.TOTAL - occ, total=service.TOTAL)
+async def free_slots(at: datetime, request: Request, response: Response,
+                     shard: LotShard = Depends(get_shard), user: str = Depends(get_current_user)):
+    return _cached_read(
+        request, response, shard, "free-slots", None, at,
+        lambda snap, t: FreeSlotsStatus(free=snap.TOTAL - snap.occupancy_at(t), total=snap.TOTAL),
+    )
+
+# Gate: verify signed QR tokens statelessly (signature, window, revocations)
+@app.post("/gate/verify", response_model=GateVerifyResponse, dependencies=[Depends(require_writer),
+          Depends(admission.limit("search"))])
+async def gate_verify(req: GateVerifyRequest, shard: LotShard = Depends(get_shard),
+                      user: str = Depends(get_current_user)):
+    at = req.at or datetime.now(timezone.utc)
+    snap = shard.snapshot
+    verdicts = verify_batch(req.tokens, at, snap.revoked, shard.qr_scope, snap.schedules)
+    return GateVerifyResponse(results=[GateVerdict(**v._asdict()) for v in verdicts])
+
+# Waitlist: a request that finds the lot full queues for its window, and
+# the lot's writer gives it the first matching slot freed by a
+# cancellation (subscribers first, then first come first served). The
+# allocation is announced on GET /waitlist/events and to the callback URL.
+# Entries live in the writer's memory and do not survive a restart.
+def _entry_info(shard: LotShard, entry) -> WaitlistEntryInfo:
+    return WaitlistEntryInfo(
+        entry_id=entry.entry_id, start=entry.start, end=entry.end, plate=entry.plate,
+        position=shard.service.waitlist.position(entry.entry_id), lot_id=shard.lot_id,
+    )
+
+@app.post("/waitlist", response_model=WaitlistResponse, dependencies=[Depends(require_writer),
+          Depends(admission.limit("book"))])
+async def join_waitlist(req: WaitlistRequest, shard: LotShard = Depends(get_shard),
+                        user: str = Depends(get_current_user)):
+    if req.callback_url and not callback_allowed(req.callback_url):
+        raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL on a host "
+                            "listed in WAITLIST_CALLBACK_HOSTS; use GET /waitlist/events otherwise")
+    # Priority belongs to the account that paid for the subscription, not
+    # to whoever types its plate
+    subscriber = await get_db()["subscribers"].find_one({"plate": req.plate.strip().upper(),
+                                                         "user": user})
+    try:
+        status, *result = await shard.engine.join_waitlist(
+            req.start, req.hours, req.days, req.months, req.plate,
+            user, subscriber is not None, req.callback_url,
+        )
+    except BookingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if status == "waiting":
+        return WaitlistResponse(status=status, entry=_entry_info(shard, result[0]))
+    slot, start_dt, end_dt, qr = result[0]
+    profiles.accrue(user, LOYALTY_POINTS_PER_BOOKING)
+    return WaitlistResponse(status=status, booking=SlotResponse(
+        slot={"row": slot[0], "col": slot[1]},
+        start=start_dt,
+        end=end_dt,
+        qr=qr,
+        booking_id=shard.snapshot.booking_id(slot[0], slot[1], start_dt, end_dt),
+        lot_id=shard.lot_id,
+    ))
+
+# Async so the live queue is read on the event loop, between writer batches
+@app.get("/waitlist", response_model=WaitlistList, dependencies=[Depends(require_writer)])
+async def my_waitlist(shard: LotShard = Depends(get_shard), user: str = Depends(get_current_user)):
+    entries = shard.service.waitlist.for_user(user)
+    return WaitlistList(entries=[_entry_info(shard, e) for e in entries])
+
+@app.delete("/waitlist/{entry_id}", response_model=SimpleMessage, dependencies=[Depends(require_writer),
+          Depends(admission.limit("book"))])
+async def leave_waitlist(entry_id: str, shard: LotShard = Depends(get_shard),
+                         user: str = Depends(get_current_user)):
+    try:
+        await shard.engine.leave_waitlist(entry_id, user)
+        return SimpleMessage(message="Left the waitlist")
+    except BookingError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# Server-sent events for the caller's allocations in any lot of this process
+WAITLIST_KEEPALIVE = 15  # seconds
+
+@app.get("/waitlist/events")
+async def waitlist_events(request: Request, user: str = Depends(get_current_user)):
+    queue = notifier.listen(user)
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), WAITLIST_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: allocated\ndata: {json.dumps(event)}\n\n"
+        finally:
+            notifier.unlisten(user, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+def _announce_allocations(shard: LotShard):
+    def allocated(entry, result):
+        slot, start_dt, end_dt, qr = result
+        profiles.accrue(entry.user, LOYALTY_POINTS_PER_BOOKING)
+        notifier.publish(entry.user, {
+            "entry_id": entry.entry_id,
+            "lot_id": shard.lot_id,
+            "booking_id": shard.snapshot.booking_id(slot[0], slot[1], start_dt, end_dt),
+            "slot": {"row": slot[0], "col": slot[1]},
+            "start": start_dt.isoformat(),
+            "end": end_dt.isoformat(),
+            "plate": entry.plate,
+            "qr": qr,
+        }, entry.callback_url)
+    return allocated
 
 # 8) Debug: list all routes on startup
 @app.on_event("startup")
@@ -110,6 +402,23 @@ def list_routes():
     for route in app.routes:
         print(f"{route.methods} -> {route.path}")
 
+@app.on_event("startup")
+async def start_booking_engine():
+    # One writer task per local lot; in writer mode each lot also gets
+    # its own shared-memory segment
+    await lots.start()
+    await profiles.start()
+    for shard in lots.shards.values():
+        shard.engine.subscribe_allocations(_announce_allocations(shard))
+
+@app.on_event("shutdown")
+async def stop_booking_engine():
+    await lots.stop()
+    # Write out loyalty points still waiting in the buffer
+    await profiles.stop()
+    await notifier.stop()
+    await close_lot_proxy()
+
 # 9) Root health-check
 @app.get("/", tags=["root"])
 async def read_root():
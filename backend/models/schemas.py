@@ -1,6 +1,6 @@
 from pydantic import BaseModel, constr, Field
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 # Auth
 class UserRegister(BaseModel):
@@ -29,6 +29,14 @@ class BookingRequest(BaseModel):
     months: int = Field(0, ge=0)
     plate: constr(strip_whitespace=True, min_length=1)
 
+class RecurringBookingRequest(BaseModel):
+    start: datetime  # first day's start; later occurrences repeat its local time of day
+    hours: int = Field(..., ge=1, le=24)
+    weekdays: List[int] = [0, 1, 2, 3, 4]  # 0 = Monday
+    until: datetime
+    plate: constr(strip_whitespace=True, min_length=1)
+    tz: str = "UTC"  # IANA zone the schedule follows, e.g. "Europe/Berlin"
+
 class CancelRequest(BaseModel):
     row: int
     col: int
@@ -45,6 +53,27 @@ class SlotResponse(BaseModel):
     start: datetime
     end: datetime
     qr: str
+    booking_id: str
+    lot_id: str
+
+class RecurringSlotResponse(SlotResponse):
+    hours: int
+    weekdays: List[int]
+    tz: str
+
+class BookingInfo(BaseModel):
+    booking_id: str
+    slot: Slot
+    start: datetime
+    end: datetime
+    plate: str
+    # Set for recurring rules: start/end bound the occurrences
+    hours: Optional[int] = None
+    weekdays: Optional[List[int]] = None
+    tz: Optional[str] = None
+
+class BookingList(BaseModel):
+    bookings: List[BookingInfo]
 
 class SlotOnly(BaseModel):
     slot: Slot
@@ -58,4 +87,51 @@ class OccupancyStatus(BaseModel):
 
 class FreeSlotsStatus(BaseModel):
     free: int
-    total: int
\ No newline at end of file
+    total: int
+
+# Lots
+class LotInfo(BaseModel):
+    lot_id: str
+    rows: int
+    cols: int
+    total: int
+    local: bool
+    url: Optional[str] = None
+
+class LotList(BaseModel):
+    default: str
+    lots: List[LotInfo]
+
+# Waitlist
+class WaitlistRequest(BookingRequest):
+    callback_url: Optional[str] = Field(None, max_length=2000)  # POSTed the allocation event
+
+class WaitlistEntryInfo(BaseModel):
+    entry_id: str
+    start: datetime
+    end: datetime
+    plate: str
+    position: Optional[int] = None  # None once the entry has left the queue
+    lot_id: str
+
+class WaitlistResponse(BaseModel):
+    status: str  # "booked" or "waiting"
+    booking: Optional[SlotResponse] = None
+    entry: Optional[WaitlistEntryInfo] = None
+
+class WaitlistList(BaseModel):
+    entries: List[WaitlistEntryInfo]
+
+# Gate
+class GateVerifyRequest(BaseModel):
+    tokens: List[str] = Field(..., max_length=1000)
+    at: Optional[datetime] = None
+
+class GateVerdict(BaseModel):
+    valid: bool
+    reason: Optional[str] = None
+    booking_id: Optional[str] = None
+    plate: Optional[str] = None
+
+class GateVerifyResponse(BaseModel):
+    results: List[GateVerdict]
\ No newline at end of file
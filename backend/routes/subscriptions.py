@@ -2,7 +2,7 @@ import os
 import stripe
 import logging
 
-from fastapi import APIRouter, HTTPException, Request, Header
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, constr
 
@@ -38,10 +38,11 @@ class SessionOut(BaseModel):
     response_model=SessionOut,
     summary="Create Checkout Session",
 )
-async def create_checkout_session(body: SessionIn):
+async def create_checkout_session(body: SessionIn, user: str = Depends(get_current_user)):
     """
     Creates a Stripe Checkout Session for the given plate.
-    Checks if the user is already subscribed.
+    Checks if the user is already subscribed. The subscription is recorded
+    against the signed-in user, who alone gets subscriber perks for it.
     """
     plate = body.plate.strip().upper()
     logging.info("Creating checkout session for %s", plate)
@@ -64,7 +65,7 @@ async def create_checkout_session(body: SessionIn):
                 "quantity": 1,
             }],
             mode="payment",
-            metadata={"plate": plate},
+            metadata={"plate": plate, "user": user},
             success_url=f"{BASE_URL}/subscribe?success=1",
             cancel_url=f"{BASE_URL}/subscribe?canceled=1",
         )
@@ -82,6 +83,8 @@ async def webhook(
 ):
     """
     Stripe webhook endpoint. Upserts subscriber on checkout.session.completed.
+    Sessions created before checkout recorded the buyer have no user: the
+    plate is still recorded, just without waitlist priority.
     """
     payload = await request.body()
 
@@ -100,16 +103,23 @@ async def webhook(
     if event["type"] == "checkout.session.completed":
         session = event["data"]["object"]
         plate = session["metadata"].get("plate")
+        user = session["metadata"].get("user")
 
         if plate:
+            fields = {
+                "plate": plate,
+                "subscribedAt": session["created"],
+                "stripeSessionId": session["id"],
+            }
+            if user:
+                fields["user"] = user
+            else:
+                logging.warning("Session %s has no user; subscriber %s gets no waitlist priority",
+                                session["id"], plate)
             db = get_db()
             await db["subscribers"].update_one(
                 {"plate": plate},
-                {"$set": {
-                    "plate": plate,
-                    "subscribedAt": session["created"],
-                    "stripeSessionId": session["id"],
-                }},
+                {"$set": fields},
                 upsert=True,
             )
             logging.info("✅ Upserted subscriber %s", plate)
@@ -1,5 +1,6 @@
 # backend/seed_subscriber.py
 import asyncio
+import os
 from datetime import datetime
 from utils.mongo import get_db
 
@@ -7,6 +8,7 @@ async def main():
     db = get_db()
     result = await db["subscribers"].insert_one({
         "plate": "AP09",
+        "user": os.getenv("SEED_USER", "test@example.com"),
         "subscribedAt": datetime.utcnow(),
         "stripeSessionId": "TEST",
     })
@@ -0,0 +1,185 @@
+# services/admission.py
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, NamedTuple, Tuple
+
+from fastapi import HTTPException, Request
+
+from auth.auth_utils import decode_access_token
+
+# Rate-limit counters: "memory" (per worker), "mongo" (shared by all
+# workers) or "off". Concurrency caps always apply.
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+# JSON object overriding ROUTE_CLASSES, e.g. {"auth": {"rate": 0.5}}
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "")
+MAX_SUBJECTS = int(os.getenv("ADMISSION_MAX_SUBJECTS", "100000"))
+
+
+class RouteClass(NamedTuple):
+    rate: float       # tokens refilled per second, per subject
+    burst: float      # bucket size, per subject
+    concurrency: int  # requests of this class in flight, per worker
+
+
+ROUTE_CLASSES: Dict[str, RouteClass] = {
+    # bcrypt hashing; keyed by client IP before login
+    "auth": RouteClass(rate=1.0, burst=20, concurrency=8),
+    # booking mutations through the lot writers
+    "book": RouteClass(rate=2.0, burst=20, concurrency=64),
+    # full reservation scans (find-slot, gate batches)
+    "search": RouteClass(rate=5.0, burst=30, concurrency=32),
+}
+
+
+class MemoryCounters:
+    """
+    Token buckets held in this process. With several workers each one
+    enforces the limits on its own, so a subject gets up to N times the
+    configured rate. Least recently seen subjects are evicted beyond
+    max_subjects and come back with a full bucket.
+    """
+
+    def __init__(self, max_subjects: int = MAX_SUBJECTS):
+        self.max_subjects = max_subjects
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take one token: 0 if granted, else seconds until one is available."""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_subjects:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoCounters:
+    """
+    Token buckets in a Mongo collection, shared by every worker and host.
+    Refill and take happen in one atomic pipeline update per request.
+    A TTL index on expiresAt removes a bucket once it would have refilled
+    completely, which is the same as it not existing.
+    """
+
+    def __init__(self, collection):
+        from pymongo import ReturnDocument
+        self._collection = collection
+        self._after = ReturnDocument.AFTER
+        self._indexed = False
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        if not self._indexed:
+            await self._collection.create_index("expiresAt", expireAfterSeconds=0)
+            self._indexed = True
+        now = time.time()
+        expires = datetime.now(timezone.utc) + timedelta(seconds=burst / rate)
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, rate]},
+        ]}]}
+        doc = await self._collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "ts": now, "expiresAt": expires}},
+                # Both fields read the refilled count from the stage above
+                {"$set": {"granted": {"$gte": ["$tokens", 1]},
+                          "tokens": {"$cond": [{"$gte": ["$tokens", 1]},
+                                               {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=self._after,
+        )
+        return 0.0 if doc["granted"] else (1 - doc["tokens"]) / rate
+
+
+def make_counters(backend: str = ADMISSION_BACKEND):
+    if backend == "off":
+        return None
+    if backend == "mongo":
+        from utils.mongo import get_db
+        return MongoCounters(get_db()["rate_limits"])
+    return MemoryCounters()
+
+
+def load_classes(spec: str = ADMISSION_LIMITS) -> Dict[str, RouteClass]:
+    classes = dict(ROUTE_CLASSES)
+    for name, opts in (json.loads(spec) if spec else {}).items():
+        classes[name] = classes[name]._replace(**opts)
+    return classes
+
+
+def request_subject(request: Request) -> str:
+    """Who a request is from: the JWT sub when a valid bearer token is sent, else the client IP."""
+    auth = request.headers.get("authorization", "")
+    if auth[:7].lower() == "bearer ":
+        payload = decode_access_token(auth[7:])
+        if payload and "sub" in payload:
+            return f"sub:{payload['sub']}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    # Retry-After takes whole seconds
+    return HTTPException(status_code=429, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class AdmissionControl:
+    """
+    Sheds load before a request does any real work:
+      - a token bucket per (route class, subject), where the subject is
+        the JWT sub when a valid bearer token is sent, else the client IP;
+      - a cap on requests of each route class in flight in this worker.
+    Rejections are immediate 429s with Retry-After, so well-behaved
+    clients keep their latency while a misbehaving one is turned away.
+    """
+
+    def __init__(self, counters=None, classes: Dict[str, RouteClass] = None):
+        self.counters = counters
+        self.classes = classes or load_classes()
+        self._in_flight: Dict[str, int] = {name: 0 for name in self.classes}
+
+    async def _check_rate(self, name: str, limits: RouteClass, request: Request) -> None:
+        if self.counters is None:
+            return
+        try:
+            wait = await self.counters.take(f"{name}:{request_subject(request)}",
+                                            limits.rate, limits.burst)
+        except Exception:
+            # A broken counter store must not take the API down with it
+            logging.exception("Admission counters unavailable; admitting request")
+            return
+        if wait > 0:
+            raise _too_many("Rate limit exceeded", wait)
+
+    def limit(self, name: str):
+        """FastAPI dependency admitting one request of route class `name`."""
+        limits = self.classes[name]
+
+        async def admit(request: Request):
+            await self._check_rate(name, limits, request)
+            if self._in_flight[name] >= limits.concurrency:
+                raise _too_many("Server busy", 1)
+            self._in_flight[name] += 1
+            try:
+                yield
+            finally:
+                self._in_flight[name] -= 1
+
+        return admit
+
+
+# Shared instance for application
+admission = AdmissionControl(make_counters())
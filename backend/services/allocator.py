@@ -0,0 +1,329 @@
+# services/allocator.py
+import bisect
+import heapq
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from collections import namedtuple
+from zoneinfo import ZoneInfo
+
+# One reservation of a slot over [start, end); shared by the index, the
+# service and the journal. owner is the account (JWT sub) that made it,
+# "" for reservations that predate ownership. serial is unique per
+# reservation and signed into its QR code, 0 for older ones.
+Booking = namedtuple("Booking", ["start", "end", "plate", "owner", "serial"], defaults=("", 0))
+
+# Recurring reservation: an occurrence of `duration` (at most a day) at
+# start's local time of day on every local weekday in the `weekdays`
+# bitmask (bit 0 = Monday), for occurrences lying wholly inside
+# [start, end). Local means in the IANA zone `tz`, so a commuter's
+# 08:00-18:00 stays put across daylight-saving changes. Kept as a rule and
+# expanded only where a query needs it.
+Rule = namedtuple("Rule", ["start", "end", "plate", "duration", "weekdays", "owner", "serial", "tz"],
+                  defaults=("", 0, "UTC"))
+
+Key = Tuple[int, int]
+Gap = Tuple[Optional[datetime], Optional[datetime]]
+Interval = Tuple[datetime, datetime]
+
+DAY = timedelta(days=1)
+
+
+def zone(name: str) -> tzinfo:
+    """tzinfo for an IANA zone name (ZoneInfo caches them)."""
+    return timezone.utc if name == "UTC" else ZoneInfo(name)
+
+
+def occurrences(rule: Rule, lo: Optional[datetime] = None,
+                hi: Optional[datetime] = None) -> Iterator[Interval]:
+    """Occurrences of `rule` overlapping [lo, hi), in time order, as UTC times."""
+    lo = rule.start if lo is None else max(lo, rule.start)
+    hi = rule.end if hi is None else min(hi, rule.end)
+    tz = zone(rule.tz)
+    clock = rule.start.astimezone(tz).time()
+    # A day early: a wall-clock occurrence can outlast `duration` by the
+    # hour a DST change adds
+    day = (lo - rule.duration).astimezone(tz).date() - DAY
+    while True:
+        local = datetime.combine(day, clock, tzinfo=tz)
+        start = local.astimezone(timezone.utc)
+        if start >= hi:
+            return
+        # Aware arithmetic is wall-clock: 08:00 + 10h ends at 18:00 local
+        end = (local + rule.duration).astimezone(timezone.utc)
+        if end > lo and start >= rule.start and end <= rule.end and rule.weekdays >> day.weekday() & 1:
+            yield start, end
+        day += DAY
+
+
+def occurrence_at(rule: Rule, at: datetime) -> Optional[Interval]:
+    """The occurrence of `rule` in progress at `at`, if any."""
+    return next(occurrences(rule, at, at + timedelta(microseconds=1)), None)
+
+
+def _disjoint(a: Iterator[Interval], b: Iterator[Interval]) -> bool:
+    """One merge pass over two time-ordered, internally disjoint interval streams."""
+    x, y = next(a, None), next(b, None)
+    while x is not None and y is not None:
+        if x[0] < y[1] and y[0] < x[1]:
+            return False
+        if x[1] <= y[1]:
+            x = next(a, None)
+        else:
+            y = next(b, None)
+    return True
+
+
+class SlotIndex:
+    """
+    Per-slot free-gap index. Each slot keeps its bookings sorted by start;
+    the free gaps are the spaces between consecutive bookings, so a window
+    is checked against one slot with a single bisect.
+
+    Recurring rules are kept per slot next to the bookings and expanded
+    lazily by at(), enclosing_gap() and rule_fits().
+
+    Per-slot tuples are replaced rather than mutated, so snapshot() is a
+    shallow copy that later writes never disturb.
+    """
+
+    def __init__(self, rows: int, cols: int):
+        self.rows, self.cols = rows, cols
+        self._slots: Dict[Key, Tuple[Booking, ...]] = {
+            (r, c): () for r in range(rows) for c in range(cols)
+        }
+        # Only slots that hold rules have an entry
+        self._rules: Dict[Key, Tuple[Rule, ...]] = {}
+
+    def snapshot(self) -> "SlotIndex":
+        snap = SlotIndex.__new__(SlotIndex)
+        snap.rows, snap.cols = self.rows, self.cols
+        snap._slots = dict(self._slots)
+        snap._rules = dict(self._rules)
+        return snap
+
+    def keys(self) -> Iterator[Key]:
+        return iter(self._slots)
+
+    def bookings(self, key: Key) -> Tuple[Booking, ...]:
+        return self._slots.get(key, ())
+
+    def rules(self, key: Key) -> Tuple[Rule, ...]:
+        return self._rules.get(key, ())
+
+    def rule_keys(self) -> Iterator[Key]:
+        return iter(self._rules)
+
+    def intervals(self, key: Key) -> List[Interval]:
+        """Every interval the slot is held for, rules expanded, by start."""
+        streams = [((b.start, b.end) for b in self._slots.get(key, ()))]
+        streams += [occurrences(rule) for rule in self._rules.get(key, ())]
+        return list(heapq.merge(*streams))
+
+    def __iter__(self) -> Iterator[Tuple[Key, Booking]]:
+        for key, lst in self._slots.items():
+            for b in lst:
+                yield key, b
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self._slots
+
+    def __len__(self) -> int:
+        return sum(len(lst) for lst in self._slots.values())
+
+    def add(self, key: Key, b: Booking) -> None:
+        if isinstance(b, Rule):
+            self._rules[key] = self._rules.get(key, ()) + (b,)
+            return
+        lst = self._slots[key]
+        i = bisect.bisect_right(lst, b.start, key=lambda x: x.start)
+        self._slots[key] = lst[:i] + (b,) + lst[i:]
+
+    def remove(self, key: Key, b: Booking) -> bool:
+        if isinstance(b, Rule):
+            rules = self._rules.get(key, ())
+            if b not in rules:
+                return False
+            rest = tuple(x for x in rules if x != b)
+            if rest:
+                self._rules[key] = rest
+            else:
+                del self._rules[key]
+            return True
+        lst = self._slots.get(key)
+        if not lst:
+            return False
+        i = bisect.bisect_left(lst, b.start, key=lambda x: x.start)
+        while i < len(lst) and lst[i].start == b.start:
+            if lst[i] == b:
+                self._slots[key] = lst[:i] + lst[i + 1:]
+                return True
+            i += 1
+        return False
+
+    def at(self, key: Key, at: datetime) -> Optional[Booking]:
+        """Booking or rule holding the slot at `at`, if any."""
+        lst = self._slots.get(key)
+        if lst:
+            i = bisect.bisect_right(lst, at, key=lambda x: x.start)
+            if i and lst[i - 1].end > at:
+                return lst[i - 1]
+        for rule in self._rules.get(key, ()):
+            if occurrence_at(rule, at):
+                return rule
+        return None
+
+    def occupied_at(self, at: datetime) -> int:
+        """Number of slots held by a booking at `at`."""
+        return sum(1 for key in self._slots if self.at(key, at))
+
+    def enclosing_gap(self, key: Key, start: datetime, end: datetime) -> Optional[Gap]:
+        """
+        Return the free gap (prev_end, next_start) that contains [start, end)
+        in this slot, or None if the window conflicts. An open side is None.
+        """
+        lst = self._slots[key]
+        i = bisect.bisect_right(lst, start, key=lambda x: x.start)
+        prev = lst[i - 1] if i else None
+        nxt = lst[i] if i < len(lst) else None
+        if prev and prev.end > start:
+            return None
+        if nxt and nxt.start < end:
+            return None
+        lo, hi = (prev.end if prev else None, nxt.start if nxt else None)
+        for rule in self._rules.get(key, ()):
+            if next(occurrences(rule, start, end), None) is not None:
+                return None
+            # A weekly pattern recurs within 8 days on either side
+            before = None
+            for _, e in occurrences(rule, start - 8 * DAY, start):
+                before = e
+            after = next(occurrences(rule, end, end + 8 * DAY), None)
+            if before is not None and (lo is None or before > lo):
+                lo = before
+            if after is not None and (hi is None or after[0] < hi):
+                hi = after[0]
+        return (lo, hi)
+
+    def rule_fits(self, key: Key, rule: Rule) -> bool:
+        """
+        True if no occurrence of `rule` overlaps anything already in the
+        slot: a single merge pass over the rule's occurrences and the
+        slot's bookings and rules within the rule's span.
+        """
+        lst = self._slots[key]
+        i = bisect.bisect_right(lst, rule.start, key=lambda x: x.start)
+        if i and lst[i - 1].end > rule.start:
+            i -= 1
+        j = bisect.bisect_left(lst, rule.end, key=lambda x: x.start)
+        held: List[Iterable[Interval]] = [((b.start, b.end) for b in lst[i:j])]
+        held += [occurrences(other, rule.start, rule.end) for other in self._rules.get(key, ())]
+        return _disjoint(heapq.merge(*held), occurrences(rule))
+
+
+# ---------------------------------------------------------------------------
+# Allocation strategies
+# ---------------------------------------------------------------------------
+
+class FirstFit:
+    """First row-major slot with no conflict (the original behaviour)."""
+    name = "first-fit"
+
+    def choose(self, index: SlotIndex, start: datetime, end: datetime,
+               keys: Optional[Sequence[Key]] = None) -> Optional[Key]:
+        for key in keys if keys is not None else index.keys():
+            if index.enclosing_gap(key, start, end) is not None:
+                return key
+        return None
+
+
+class BestFit:
+    """
+    Slot whose enclosing free gap fits the window most tightly. Gaps bounded
+    on both sides beat half-open ones, which beat empty slots, so short
+    bookings pack next to existing ones and long free runs stay intact.
+    """
+    name = "best-fit"
+
+    @staticmethod
+    def _score(gap: Gap, start: datetime, end: datetime) -> Tuple[int, timedelta]:
+        lo, hi = gap
+        if lo is not None and hi is not None:
+            return (0, hi - lo)
+        if lo is not None:
+            return (1, start - lo)
+        if hi is not None:
+            return (1, hi - end)
+        return (2, timedelta(0))
+
+    def choose(self, index: SlotIndex, start: datetime, end: datetime,
+               keys: Optional[Sequence[Key]] = None) -> Optional[Key]:
+        best, best_score = None, None
+        for key in keys if keys is not None else index.keys():
+            gap = index.enclosing_gap(key, start, end)
+            if gap is None:
+                continue
+            score = self._score(gap, start, end)
+            if best_score is None or score < best_score:
+                best, best_score = key, score
+                if score == (0, end - start):
+                    break  # exact fit
+        return best
+
+
+class ZoneAffinity:
+    """
+    Keep bookings of similar length together: each duration class owns a
+    band of rows (searched best-fit), falling back to the whole lot.
+    """
+    name = "zone"
+
+    def __init__(self, rows: int, cols: int,
+                 zones: Optional[Sequence[Tuple[timedelta, range]]] = None):
+        if zones is None:
+            short, multi = rows // 2, rows // 2 + rows // 4
+            zones = [
+                (timedelta(days=1), range(0, short)),
+                (timedelta(days=7), range(short, multi)),
+                (timedelta.max, range(multi, rows)),
+            ]
+        self._zones = [(limit, [(r, c) for r in band for c in range(cols)])
+                       for limit, band in zones]
+        self._fit = BestFit()
+
+    def choose(self, index: SlotIndex, start: datetime, end: datetime,
+               keys: Optional[Sequence[Key]] = None) -> Optional[Key]:
+        length = end - start
+        for limit, zone_keys in self._zones:
+            if length <= limit:
+                slot = self._fit.choose(index, start, end, zone_keys)
+                if slot is not None:
+                    return slot
+                break
+        return self._fit.choose(index, start, end, keys)
+
+
+def choose_rule_slot(index: SlotIndex, rule: Rule,
+                     keys: Optional[Sequence[Key]] = None) -> Optional[Key]:
+    """
+    First slot that can take every occurrence of `rule`. Slots already
+    holding rules are tried first, so recurring schedules share slots and
+    whole slots stay free for one-off bookings.
+    """
+    candidates = list(keys if keys is not None else index.keys())
+    with_rules = set(index.rule_keys())
+    candidates.sort(key=lambda k: k not in with_rules)
+    for key in candidates:
+        if index.rule_fits(key, rule):
+            return key
+    return None
+
+
+def make_strategy(name: str, rows: int, cols: int):
+    """Build an allocation strategy by name: first-fit, best-fit or zone."""
+    if name == FirstFit.name:
+        return FirstFit()
+    if name == BestFit.name:
+        return BestFit()
+    if name == ZoneAffinity.name:
+        return ZoneAffinity(rows, cols)
+    raise ValueError(f"Unknown allocation strategy: {name}")
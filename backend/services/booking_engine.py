@@ -0,0 +1,123 @@
+# services/booking_engine.py
+import asyncio
+from typing import Any, Callable, List, Optional
+
+from services.booking_service import BookingService, BookingView
+from services.waitlist import WaitlistEntry
+
+# How often the idle writer archives finished bookings (seconds)
+EXPIRE_INTERVAL = 60.0
+
+
+class BookingEngine:
+    """
+    Single-writer actor around BookingService. Every mutation is queued to
+    one writer task on the event loop, so the (non thread-safe) service is
+    only ever touched from one place. After each batch of commands the
+    writer publishes a fresh immutable BookingView that reads use without
+    locking.
+    """
+
+    def __init__(self, svc: BookingService):
+        self._service = svc
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.snapshot: BookingView = svc.snapshot()
+        self._listeners: List[Callable[[BookingView], None]] = []
+        self._allocation_listeners: List[Callable[[WaitlistEntry, tuple], None]] = []
+
+    def subscribe(self, fn: Callable[[BookingView], None]) -> None:
+        """Call fn with every newly published snapshot (and the current one)."""
+        self._listeners.append(fn)
+        fn(self.snapshot)
+
+    def subscribe_allocations(self, fn: Callable[[WaitlistEntry, tuple], None]) -> None:
+        """Call fn(entry, book() result) for each waitlist entry given a slot."""
+        self._allocation_listeners.append(fn)
+
+    def _publish(self) -> None:
+        self.snapshot = self._service.snapshot()
+        for fn in self._listeners:
+            fn(self.snapshot)
+        # Announced after the snapshot, so the new booking is already visible
+        for entry, result in self._service.drain_allocations():
+            for fn in self._allocation_listeners:
+                fn(entry, result)
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._writer is not None and self._loop is loop and not self._writer.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._writer = loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._writer is None:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+
+    async def _submit(self, fn: Callable, *args) -> Any:
+        await self.start()
+        fut = self._loop.create_future()
+        await self._queue.put((fn, args, fut))
+        return await fut
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), EXPIRE_INTERVAL)
+            except asyncio.TimeoutError:
+                if self._service.expire():
+                    self._publish()
+                continue
+
+            # Drain whatever else is queued and apply it as one batch
+            batch = [item]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            for cmd in batch:
+                if cmd is None:
+                    continue
+                fn, args, fut = cmd
+                try:
+                    result = fn(*args)
+                except Exception as e:
+                    if not fut.done():
+                        fut.set_exception(e)
+                else:
+                    if not fut.done():
+                        fut.set_result(result)
+
+            self._service.expire()
+            self._publish()
+            if None in batch:
+                return
+
+    # -- mutations (serialized through the writer) --------------------------
+
+    async def book(self, start, duration_h, duration_d, duration_m, plate, owner=""):
+        return await self._submit(self._service.book, start, duration_h,
+                                  duration_d, duration_m, plate, owner)
+
+    async def book_recurring(self, start, duration_h, weekdays, until, plate, owner="", tz="UTC"):
+        return await self._submit(self._service.book_recurring, start, duration_h,
+                                  weekdays, until, plate, owner, tz)
+
+    async def cancel(self, r, c, start, end, plate, owner):
+        return await self._submit(self._service.cancel, r, c, start, end, plate, owner)
+
+    async def cancel_by_id(self, booking_id, owner):
+        return await self._submit(self._service.cancel_by_id, booking_id, owner)
+
+    async def join_waitlist(self, start, duration_h, duration_d, duration_m, plate,
+                            user, subscriber=False, callback_url=None):
+        return await self._submit(self._service.join_waitlist, start, duration_h, duration_d,
+                                  duration_m, plate, user, subscriber, callback_url)
+
+    async def leave_waitlist(self, entry_id, user):
+        return await self._submit(self._service.leave_waitlist, entry_id, user)
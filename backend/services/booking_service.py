@@ -79,16 +79,19 @@ def replay_reservations() -> dict:
 
 
 # services/booking_service.py
+import bisect
 import calendar
-import uuid
+import heapq
+import itertools
+import os
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple
-from collections import namedtuple
+from typing import AbstractSet, Dict, FrozenSet, List, Mapping, Optional, Sequence, Tuple
 
-from utils.logger import log_booking, log_cancellation, replay_reservations
-
-# Define Booking tuple used within service
-Booking = namedtuple("Booking", ["start", "end", "plate"])
+from utils.logger import Journal, journal as default_journal
+from services.allocator import Booking, Rule, SlotIndex, choose_rule_slot, make_strategy, occurrences, zone
+from services.qr_tokens import parse_slot_id, sign_qr, token_body
+from services.waitlist import Waitlist, WaitlistEntry
 
 
 class BookingError(Exception):
@@ -96,27 +99,196 @@ class BookingError(Exception):
     pass
 
 
-class BookingService:
-    ROWS, COLS = 20, 20
-    TOTAL = ROWS * COLS
-    MAX_DURATION = timedelta(days=2000)
+class BookingNotFound(BookingError):
+    """No reservation matches, or it belongs to another account."""
+    pass
+
 
-    def __init__(self):
-        # Initialize reservation state from logs
-        self.res = replay_reservations()
+class BookingView:
+    """
+    Read-only queries over reservation state. BookingService extends it;
+    snapshot() returns a plain view over immutable copies that can be read
+    without locks while the writer moves on.
+    """
+
+    def __init__(self, res: SlotIndex,
+                 by_plate: Dict[str, FrozenSet[Tuple[Tuple[int, int], Booking]]],
+                 allocator, revoked: AbstractSet[str] = frozenset(), version: int = 0,
+                 schedules: Mapping[str, Rule] = {}):
+        # Grid dimensions come from the index, so every lot can have its own
+        self.ROWS, self.COLS = res.rows, res.cols
+        self.TOTAL = self.ROWS * self.COLS
+        self.res = res
+        self.by_plate = by_plate
+        self.allocator = allocator
+        # QR token bodies of cancelled, not yet ended reservations
+        self.revoked = revoked
+        # Monotonic state version, bumped on every change to the live set
+        self.version = version
+        # Booking id -> recurring rule, so gates can check the schedule
+        self.schedules = schedules
+
+    @staticmethod
+    def _norm_plate(plate: str) -> str:
+        return plate.strip().upper()
+
+    def booking_id(self, r: int, c: int, s: datetime, e: datetime) -> str:
+        """Stable id for a reservation: rrcc-yymmddHHMM-yymmddHHMM (UTC)."""
+        t1 = s.astimezone(timezone.utc).strftime("%y%m%d%H%M")
+        t2 = e.astimezone(timezone.utc).strftime("%y%m%d%H%M")
+        return f"{r:02d}{c:02d}-{t1}-{t2}"
+
+    def bookings_for_plate(self, plate: str, owner: Optional[str] = None) -> List[Tuple[Tuple[int, int], Booking]]:
+        """Live reservations held by a plate (made by `owner`, if given), ordered by start time."""
+        now = datetime.now(timezone.utc)
+        found = [kb for kb in self.by_plate.get(self._norm_plate(plate), ())
+                 if kb[1].end > now and (owner is None or kb[1].owner == owner)]
+        return sorted(found, key=lambda kb: (kb[1].start, kb[0]))
 
     def occupancy_at(self, at: datetime) -> int:
+        return self.res.occupied_at(at.astimezone(timezone.utc))
+
+    def find_slot(self, start: datetime, end: datetime) -> Optional[Tuple[int, int]]:
+        start = start.astimezone(timezone.utc)
+        end = end.astimezone(timezone.utc)
+        return self.allocator.choose(self.res, start, end)
+
+    def is_slot_occupied(self, slot_id: str, at: datetime) -> bool:
+        key = parse_slot_id(slot_id)
+        if key is None:
+            return False
+
         at = at.astimezone(timezone.utc)
-        return sum(1 for b in self.res.values() if b.start <= at < b.end)
+        return key in self.res and self.res.at(key, at) is not None
+
+
+class BookingService(BookingView):
+    MAX_DURATION = timedelta(days=2000)
+    # book() failures that a waitlist entry can wait out
+    CAPACITY_ERRORS = ("No free slots at that time.", "No non-overlapping slot found.")
+    ALLOCATOR = os.getenv("BOOKING_ALLOCATOR", "best-fit")
+    # Live waitlist entries one account may hold per lot
+    WAITLIST_MAX_PER_USER = int(os.getenv("WAITLIST_MAX_PER_USER", "10"))
+
+    def __init__(self, rows: int = 20, cols: int = 20, journal: Optional[Journal] = None,
+                 allocator: Optional[str] = None, replay: bool = True, lot_id: str = ""):
+        super().__init__(
+            # Per-slot bookings sorted by start (free-gap index)
+            res=SlotIndex(rows, cols),
+            # Secondary index: normalized plate -> reservation keys ((r, c), booking)
+            by_plate={},
+            # Slot allocation strategy (first-fit, best-fit or zone)
+            allocator=make_strategy(allocator or self.ALLOCATOR, rows, cols),
+        )
+        # Append-only journal this service replays from and logs to
+        self.journal = journal or default_journal
+        # Scopes QR signatures to this lot ("" for the original single lot)
+        self.lot_id = lot_id
+        self.revoked = set()
+        self.schedules = {}
+        # Requests waiting for capacity, and allocations made for them
+        # that the engine has not announced yet
+        self.waitlist = Waitlist()
+        self.allocations: List[Tuple[WaitlistEntry, tuple]] = []
+        # Seeded from the clock so versions keep increasing across restarts;
+        # caches and shared-memory readers key on it
+        self.version = time.time_ns() // 1000
+        # Expiry heap of (end, seq, key, booking); entries are validated
+        # lazily on pop. seq breaks ties before the reservations themselves,
+        # which do not compare (a Booking's owner against a Rule's duration)
+        self._expiry: List[Tuple[datetime, int, Tuple[int, int], Booking]] = []
+        self._seq = itertools.count()
+
+        if not replay:
+            return
+
+        # Initialize live reservation state from logs; finished bookings
+        # stay in the journal only
+        now = datetime.now(timezone.utc)
+        for key, b in self.journal.replay_reservations(since=now):
+            if key in self.res:
+                self.res.add(key, b)
+                self._index(key, b)
+        for key, b in self.journal.cancelled_reservations(since=now):
+            self._revoke(key, b)
+
+    def snapshot(self) -> BookingView:
+        """Immutable point-in-time view of the live reservations."""
+        return BookingView(self.res.snapshot(), dict(self.by_plate), self.allocator,
+                           frozenset(self.revoked), self.version, self.schedules)
+
+    def _index(self, key: Tuple[int, int], b: Booking) -> None:
+        # Plate sets are replaced, not mutated, so snapshots stay frozen
+        self.by_plate[b.plate] = self.by_plate.get(b.plate, frozenset()) | {(key, b)}
+        heapq.heappush(self._expiry, (b.end, next(self._seq), key, b))
+        if isinstance(b, Rule):
+            # Replaced, not mutated, like the plate sets; rules change rarely
+            self.schedules = {**self.schedules, self.booking_id(*key, b.start, b.end): b}
+
+    @staticmethod
+    def _token_body(key: Tuple[int, int], b: Booking) -> str:
+        return token_body(*key, b.start, b.end, b.plate, b.serial)
+
+    def _revoke(self, key: Tuple[int, int], b: Booking) -> None:
+        # Dropped again when the booking's expiry entry is popped; never
+        # because of a new booking
+        self.revoked.add(self._token_body(key, b))
+        heapq.heappush(self._expiry, (b.end, next(self._seq), key, b))
+
+    def _unindex(self, key: Tuple[int, int], b: Booking) -> None:
+        if isinstance(b, Rule):
+            bid = self.booking_id(*key, b.start, b.end)
+            self.schedules = {k: v for k, v in self.schedules.items() if k != bid}
+        keys = self.by_plate.get(b.plate)
+        if keys is None:
+            return
+        keys = keys - {(key, b)}
+        if keys:
+            self.by_plate[b.plate] = keys
+        else:
+            del self.by_plate[b.plate]
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """
+        Archive reservations that have ended by `now`: they leave the live
+        index and remain queryable from the journal. Waitlist entries whose
+        window has started are dropped. Returns the archived count.
+        """
+        now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+        self.waitlist.expire(now)
+        archived = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, _, key, b = heapq.heappop(self._expiry)
+            # Stale entry: the booking was cancelled; its QR has now expired
+            if not self.res.remove(key, b):
+                self.revoked.discard(self._token_body(key, b))
+                continue
+            self._unindex(key, b)
+            archived += 1
+        if archived:
+            self.version += 1
+        return archived
+
+    def bookings_for_plate(self, plate: str, owner: Optional[str] = None) -> List[Tuple[Tuple[int, int], Booking]]:
+        self.expire()
+        return super().bookings_for_plate(plate, owner)
+
+    def archived_for_plate(self, plate: str, owner: Optional[str] = None) -> List[Tuple[Tuple[int, int], Booking]]:
+        """Finished reservations for a plate (made by `owner`, if given), read back from the journal."""
+        found = self.journal.archived_reservations(datetime.now(timezone.utc), self._norm_plate(plate))
+        return [kb for kb in found if owner is None or kb[1].owner == owner]
+
+    def occupancy_at(self, at: datetime) -> int:
+        self.expire()
+        return super().occupancy_at(at)
 
     def find_slot(self, start: datetime, end: datetime) -> Optional[Tuple[int, int]]:
-        for r in range(self.ROWS):
-            for c in range(self.COLS):
-                b = self.res.get((r, c))
-                # No booking or non-overlapping booking
-                if not b or not (b.start < end and start < b.end):
-                    return (r, c)
-        return None
+        self.expire()
+        return super().find_slot(start, end)
+
+    def is_slot_occupied(self, slot_id: str, at: datetime) -> bool:
+        self.expire()
+        return super().is_slot_occupied(slot_id, at)
 
     def _add_months(self, dt: datetime, months: int) -> datetime:
         month = dt.month - 1 + months
@@ -125,36 +297,23 @@ class BookingService:
         day = min(dt.day, calendar.monthrange(year, month)[1])
         return dt.replace(year=year, month=month, day=day)
 
-    def generate_qr(self, r: int, c: int, s: datetime, e: datetime, plate: str) -> str:
-        t1 = s.strftime("%y%m%d%H%M")
-        t2 = e.strftime("%y%m%d%H%M")
-        token = uuid.uuid4().hex[:8]
-        return f"SLOT-{r:02d}{c:02d}-{t1}-{t2}-{plate}-{token}"
-
-    def is_slot_occupied(self, slot_id: str, at: datetime) -> bool:
-        try:
-            # Parse slot_id: SLOT-rrcc-...
-            parts = slot_id.split("-")
-            if len(parts) < 2:
-                return False
-            r, c = int(parts[1][:2]), int(parts[1][2:4])
-        except Exception:
-            return False
-
-        at = at.astimezone(timezone.utc)
-        b = self.res.get((r, c))
-        return bool(b and b.start <= at < b.end)
+    def generate_qr(self, r: int, c: int, s: datetime, e: datetime, plate: str,
+                    serial: int = 0) -> str:
+        return sign_qr(r, c, s, e, plate, self.lot_id, serial)
 
     def book(self, start: datetime, duration_h: int, duration_d: int,
-             duration_m: int, plate: str) -> Tuple[str, datetime, datetime, str]:
+             duration_m: int, plate: str, owner: str = "") -> Tuple[str, datetime, datetime, str]:
+        start, end, plate = self._window(start, duration_h, duration_d, duration_m, plate)
+        return self._place(start, end, plate, owner)
+
+    def _window(self, start: datetime, duration_h: int, duration_d: int,
+                duration_m: int, plate: str) -> Tuple[datetime, datetime, str]:
+        """Validate a booking request; returns (start, end, plate) normalized."""
         # Validate durations
         if duration_h < 0 or duration_d < 0 or duration_m < 0:
             raise BookingError("Duration parts must be ≥ 0.")
         if duration_h == 0 and duration_d == 0 and duration_m == 0:
             raise BookingError("Duration cannot be zero.")
-        
-        
-        print("Hello I am in this part of the code")
 
         # Normalize to UTC
         start = start.astimezone(timezone.utc)
@@ -162,7 +321,7 @@ class BookingService:
         if start <= now:
             raise BookingError("Start must be in the future.")
 
-        plate = plate.strip().upper()
+        plate = self._norm_plate(plate)
         if not plate:
             raise BookingError("Plate cannot be empty.")
 
@@ -175,48 +334,223 @@ class BookingService:
         # Enforce maximum booking duration
         if (end - start) > self.MAX_DURATION:
             raise BookingError("Booking duration exceeds allowed maximum.")
+        return start, end, plate
 
-        # Check overall occupancy
-        if self.TOTAL - self.occupancy_at(start) <= 0:
-            raise BookingError("No free slots at that time.")
-
-        # Find a free slot
-        slot = self.find_slot(start, end)
-        print(slot)
+    def _place(self, start: datetime, end: datetime, plate: str, owner: str = "",
+               slot: Optional[Tuple[int, int]] = None) -> Tuple[str, datetime, datetime, str]:
+        """Allocate (or take `slot`, if it is free), store and journal a validated window."""
         if slot is None:
+            # Check overall occupancy
+            if self.TOTAL - self.occupancy_at(start) <= 0:
+                raise BookingError("No free slots at that time.")
+
+            # Find a free slot
+            slot = self.find_slot(start, end)
+            if slot is None:
+                raise BookingError("No non-overlapping slot found.")
+        elif self.res.enclosing_gap(slot, start, end) is None:
             raise BookingError("No non-overlapping slot found.")
         r, c = slot
         
-        # Store booking
-        self.res[(r, c)] = Booking(start=start, end=end, plate=plate)
-
-        # Log the booking
-        log_booking(r, c, plate,
-                    start.year, start.month, start.day, start.hour, start.minute,
-                    end.year, end.month, end.day, end.hour, end.minute)
+        # Store and log the booking; the new version doubles as its serial
+        self.version += 1
+        booking = Booking(start=start, end=end, plate=plate, owner=owner, serial=self.version)
+        self._store((r, c), booking)
 
         # Generate and return identifiers
-        qr = self.generate_qr(r, c, start, end, plate)
+        qr = self.generate_qr(r, c, start, end, plate, booking.serial)
         slot_id = f"{r:02d}{c:02d}"
         
         return (r,c), start, end, qr
 
-    def cancel(self, r: int, c: int, start: datetime, end: datetime, plate: str) -> None:
+    def _store(self, key: Tuple[int, int], b: Booking) -> None:
+        """Add, index and journal a new reservation: all of it or none of it."""
+        self.res.add(key, b)
+        try:
+            self._index(key, b)
+            r, c = key
+            s, e = b.start, b.end
+            self.journal.log_booking(r, c, b.plate,
+                                     s.year, s.month, s.day, s.hour, s.minute,
+                                     e.year, e.month, e.day, e.hour, e.minute,
+                                     *self._schedule_fields(b), owner=b.owner, serial=b.serial,
+                                     tz=getattr(b, "tz", "UTC"))
+        except BaseException:
+            # A reservation the journal does not have would vanish on restart
+            self.res.remove(key, b)
+            self._unindex(key, b)
+            raise
+
+    # -- waitlist -------------------------------------------------------------
+
+    def join_waitlist(self, start: datetime, duration_h: int, duration_d: int, duration_m: int,
+                      plate: str, user: str, subscriber: bool = False,
+                      callback_url: Optional[str] = None):
+        """
+        Book now if possible, else queue for the window. Returns
+        ("booked", book() result) or ("waiting", entry, position).
+        """
+        start, end, plate = self._window(start, duration_h, duration_d, duration_m, plate)
+        try:
+            return "booked", self._place(start, end, plate, user)
+        except BookingError as e:
+            if str(e) not in self.CAPACITY_ERRORS:
+                raise
+        if self.waitlist.count_for(user) >= self.WAITLIST_MAX_PER_USER:
+            raise BookingError(f"At most {self.WAITLIST_MAX_PER_USER} waitlist entries per account.")
+        entry = self.waitlist.add(start, end, plate, user, subscriber, callback_url)
+        return "waiting", entry, self.waitlist.position(entry.entry_id)
+
+    def leave_waitlist(self, entry_id: str, user: str) -> WaitlistEntry:
+        entry = self.waitlist.get(entry_id)
+        if entry is None or entry.user != user:
+            raise BookingError("No matching waitlist entry found.")
+        return self.waitlist.remove(entry_id)
+
+    def _match(self, key: Tuple[int, int], freed: List[Tuple[datetime, datetime]]) -> None:
+        """
+        Offer slot `key`, just freed over the sorted, disjoint `freed`
+        intervals, to waiting requests, best first. Nothing else changed,
+        so no other slot can serve a request that was still waiting. Stops
+        once no freed time is left. Each allocation is a normal booking
+        and is queued in self.allocations for the engine to announce.
+        """
+        now = datetime.now(timezone.utc)
+        freed = [(s, e) for s, e in freed if e > now]
+        if not freed:
+            return
+        for entry in self.waitlist.candidates(freed[0][0], freed[-1][1]):
+            if entry.start <= now:
+                continue  # started; dropped by the next expire()
+            i = bisect.bisect_right(freed, entry.start, key=lambda iv: iv[1])
+            if i == len(freed) or freed[i][0] >= entry.end:
+                continue  # falls between the freed intervals
+            try:
+                result = self._place(entry.start, entry.end, entry.plate, entry.user, slot=key)
+            except BookingError:
+                continue
+            self.waitlist.remove(entry.entry_id)
+            self.allocations.append((entry, result))
+            freed = [piece for s, e in freed
+                     for piece in ((s, min(e, entry.start)), (max(s, entry.end), e)) if piece[0] < piece[1]]
+            if not freed:
+                return
+
+    def drain_allocations(self) -> List[Tuple[WaitlistEntry, tuple]]:
+        drained, self.allocations = self.allocations, []
+        return drained
+
+    MAX_RULE_HOURS = 24
+
+    @staticmethod
+    def _schedule_fields(b) -> Tuple[int, ...]:
+        """Extra journal fields for a rule: (duration minutes, weekday bitmask)."""
+        if isinstance(b, Rule):
+            return (int(b.duration.total_seconds()) // 60, b.weekdays)
+        return ()
+
+    def book_recurring(self, start: datetime, duration_h: int, weekdays: Sequence[int],
+                       until: datetime, plate: str, owner: str = "",
+                       tz: str = "UTC") -> Tuple[Tuple[int, int], Rule, str]:
+        """
+        Reserve one slot for `duration_h` hours from start's time of day on
+        each of `weekdays` (0 = Monday) until `until`, both reckoned in the
+        IANA zone `tz`. Stored as one rule, not as its occurrences.
+        Returns ((r, c), rule, qr).
+        """
+        if not 0 < duration_h <= self.MAX_RULE_HOURS:
+            raise BookingError(f"Recurring duration must be 1-{self.MAX_RULE_HOURS} hours.")
+        if not weekdays or any(not 0 <= d <= 6 for d in weekdays):
+            raise BookingError("Weekdays must be 0 (Monday) to 6 (Sunday).")
+        mask = sum(1 << d for d in set(weekdays))
+        try:
+            zone(tz)
+        except (ValueError, LookupError):
+            raise BookingError(f"Unknown time zone: {tz}")
+
+        start = start.astimezone(timezone.utc)
+        until = until.astimezone(timezone.utc)
+        if start <= datetime.now(timezone.utc):
+            raise BookingError("Start must be in the future.")
+        if until - start > self.MAX_DURATION:
+            raise BookingError("Booking duration exceeds allowed maximum.")
+
+        plate = self._norm_plate(plate)
+        if not plate:
+            raise BookingError("Plate cannot be empty.")
+
+        duration = timedelta(hours=duration_h)
+        # Anchor the rule on its first and last real occurrences, so its
+        # id, QR window and expiry match what it actually holds
+        first = last = None
+        for occ in occurrences(Rule(start, until, plate, duration, mask, tz=tz)):
+            first = first or occ
+            last = occ
+        if first is None:
+            raise BookingError("Schedule has no occurrences before the end date.")
+        rule = Rule(first[0], last[1], plate, duration, mask, owner, tz=tz)
+
+        self.expire()
+        slot = choose_rule_slot(self.res, rule)
+        if slot is None:
+            raise BookingError("No slot is free for every occurrence.")
+        r, c = slot
+
+        self.version += 1
+        rule = rule._replace(serial=self.version)
+        self._store(slot, rule)
+        return slot, rule, self.generate_qr(r, c, rule.start, rule.end, plate, rule.serial)
+
+    def cancel(self, r: int, c: int, start: datetime, end: datetime, plate: str,
+               owner: Optional[str]) -> Booking:
+        """Cancel `owner`'s booking (anyone's, if None) of slot (r, c) over [start, end) and return it."""
         key = (r, c)
         start = start.astimezone(timezone.utc)
         end = end.astimezone(timezone.utc)
-        plate = plate.strip().upper()
-        booking = self.res.get(key)
+        plate = self._norm_plate(plate)
 
-        # Validate cancel request
-        if not booking or booking.plate != plate or booking.start != start or booking.end != end:
-            raise BookingError("No matching reservation found.")
+        # Validate cancel request; other accounts' bookings are not found
+        for booking in self.res.bookings(key):
+            if (booking.start, booking.end, booking.plate) == (start, end, plate) and \
+                    owner in (None, booking.owner):
+                break
+        else:
+            raise BookingNotFound("No matching reservation found.")
 
-        # Remove and log cancellation
-        self.res.pop(key)
-        log_cancellation(r, c, plate,
-                         start.year, start.month, start.day, start.hour, start.minute,
-                         end.year, end.month, end.day, end.hour, end.minute)
+        self._drop(key, booking)
+        return booking
 
-# Shared instance for application
-service = BookingService()
+    def cancel_by_id(self, booking_id: str, owner: Optional[str]) -> Booking:
+        """Cancel `owner`'s reservation (anyone's, if None) identified by booking_id and return it."""
+        try:
+            rc = booking_id.split("-", 1)[0]
+            key = (int(rc[:2]), int(rc[2:4]))
+        except ValueError:
+            raise BookingError("Invalid booking id.")
+
+        for booking in self.res.bookings(key) + self.res.rules(key):
+            if self.booking_id(*key, booking.start, booking.end) == booking_id and owner in (None, booking.owner):
+                break
+        else:
+            raise BookingNotFound("No matching reservation found.")
+
+        self._drop(key, booking)
+        return booking
+
+    def _drop(self, key: Tuple[int, int], booking: Booking) -> None:
+        # Log the cancellation first: if that fails, nothing has changed
+        r, c = key
+        s, e = booking.start, booking.end
+        self.journal.log_cancellation(r, c, booking.plate,
+                                      s.year, s.month, s.day, s.hour, s.minute,
+                                      e.year, e.month, e.day, e.hour, e.minute,
+                                      *self._schedule_fields(booking), owner=booking.owner,
+                                      serial=booking.serial, tz=getattr(booking, "tz", "UTC"))
+        # Remove, unindex and revoke the QR
+        self.res.remove(key, booking)
+        self._unindex(key, booking)
+        self._revoke(key, booking)
+        self.version += 1
+        # Hand the freed slot to the waitlist
+        self._match(key, list(occurrences(booking)) if isinstance(booking, Rule)
+                    else [(booking.start, booking.end)])
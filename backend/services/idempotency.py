@@ -0,0 +1,220 @@
+# services/idempotency.py
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from services.admission import request_subject
+
+# "memory" (per worker) or "mongo" (shared by all workers)
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))  # seconds
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+# How long an unfinished request holds its key (a crashed worker's lease)
+PENDING_LEASE = 60
+MAX_KEY_LENGTH = 255
+
+# POST routes that honour an Idempotency-Key header
+IDEMPOTENT_PATHS = frozenset({"/book", "/book/recurring", "/cancel", "/waitlist",
+                              "/payments/create-intent"})
+
+# Outcomes of IdempotencyStore.begin()
+NEW, PENDING, DONE, MISMATCH = "new", "pending", "done", "mismatch"
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+class MemoryIdempotencyStore:
+    """
+    Responses held in this process, oldest first. Entries expire after
+    `ttl` seconds and the oldest are evicted beyond `max_keys`.
+    """
+
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # key -> (expires, fingerprint, StoredResponse or None while pending)
+        self._entries: "OrderedDict[str, Tuple[float, str, Optional[StoredResponse]]]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            key, (expires, _, _) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[key]
+
+    async def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        now = time.monotonic()
+        self._evict(now)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + PENDING_LEASE, fingerprint, None)
+            return NEW, None
+        _, fp, stored = entry
+        if fp != fingerprint:
+            return MISMATCH, None
+        if stored is None:
+            return PENDING, None
+        return DONE, stored
+
+    async def complete(self, key: str, fingerprint: str, stored: StoredResponse) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, fingerprint, stored)
+        self._evict(time.monotonic())
+
+    async def release(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+
+class MongoIdempotencyStore:
+    """
+    Responses in a Mongo collection, shared by every worker. A pending
+    document claims the key; a TTL index on expiresAt removes old ones.
+    """
+
+    def __init__(self, collection, ttl: int = IDEMPOTENCY_TTL):
+        from pymongo.errors import DuplicateKeyError
+        self._collection = collection
+        self._duplicate = DuplicateKeyError
+        self.ttl = ttl
+        self._indexed = False
+
+    async def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        if not self._indexed:
+            await self._collection.create_index("expiresAt", expireAfterSeconds=0)
+            self._indexed = True
+        now = datetime.now(timezone.utc)
+        lease = {"fp": fingerprint, "state": PENDING, "expiresAt": now + timedelta(seconds=PENDING_LEASE)}
+        try:
+            await self._collection.insert_one({"_id": key, **lease})
+            return NEW, None
+        except self._duplicate:
+            doc = await self._collection.find_one({"_id": key})
+        if doc is None:
+            return PENDING, None  # removed in between; the client retries
+        if doc["expiresAt"].replace(tzinfo=timezone.utc) <= now:
+            # Expired but not yet reaped by the TTL monitor: take it over
+            taken = await self._collection.update_one(
+                {"_id": key, "expiresAt": doc["expiresAt"]}, {"$set": lease})
+            return (NEW, None) if taken.modified_count else (PENDING, None)
+        if doc["fp"] != fingerprint:
+            return MISMATCH, None
+        if doc["state"] == PENDING:
+            return PENDING, None
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in doc["headers"]]
+        return DONE, StoredResponse(doc["status"], headers, doc["body"])
+
+    async def complete(self, key: str, fingerprint: str, stored: StoredResponse) -> None:
+        await self._collection.update_one({"_id": key}, {"$set": {
+            "state": DONE,
+            "status": stored.status,
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in stored.headers],
+            "body": stored.body,
+            "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+        }})
+
+    async def release(self, key: str) -> None:
+        await self._collection.delete_one({"_id": key})
+
+
+def make_store(backend: str = IDEMPOTENCY_BACKEND):
+    if backend == "mongo":
+        from utils.mongo import get_db
+        return MongoIdempotencyStore(get_db()["idempotency_keys"])
+    return MemoryIdempotencyStore()
+
+
+class IdempotencyMiddleware:
+    """
+    Replays the stored response for a repeated Idempotency-Key instead of
+    running the request again. Keys are scoped to the caller (JWT sub or
+    client IP) and the route. Only 2xx responses are stored, so a failed
+    attempt can be retried with the same key. While the first attempt is
+    still running a repeat gets 409; reusing a key for a different request
+    gets 422.
+    """
+
+    def __init__(self, app, store=None, paths=IDEMPOTENT_PATHS):
+        self.app = app
+        self.store = store or make_store()
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        key = request.headers.get("idempotency-key")
+        if not key:
+            return await self.app(scope, receive, send)
+        if len(key) > MAX_KEY_LENGTH:
+            return await JSONResponse({"detail": "Idempotency-Key is too long"},
+                                      status_code=400)(scope, receive, send)
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        fingerprint = hashlib.blake2b(
+            scope["path"].encode() + b"?" + scope["query_string"] + b"\0" + body,
+            digest_size=16).hexdigest()
+        store_key = f"{request_subject(request)}|{scope['path']}|{key}"
+
+        try:
+            state, stored = await self.store.begin(store_key, fingerprint)
+        except Exception:
+            # Without the store a retry could run twice; refuse rather than guess
+            logging.exception("Idempotency store unavailable")
+            return await JSONResponse({"detail": "Idempotency store unavailable"},
+                                      status_code=503)(scope, receive, send)
+        if state == DONE:
+            await send({"type": "http.response.start", "status": stored.status,
+                        "headers": stored.headers + [(b"idempotent-replayed", b"true")]})
+            return await send({"type": "http.response.body", "body": stored.body})
+        if state == PENDING:
+            return await JSONResponse({"detail": "A request with this Idempotency-Key is in progress"},
+                                      status_code=409, headers={"Retry-After": "1"})(scope, receive, send)
+        if state == MISMATCH:
+            return await JSONResponse({"detail": "Idempotency-Key was used for a different request"},
+                                      status_code=422)(scope, receive, send)
+
+        replayed_body = False
+
+        async def receive_buffered():
+            nonlocal replayed_body
+            if not replayed_body:
+                replayed_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status, headers, chunks = 500, [], []
+
+        async def capture(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status, headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_buffered, capture)
+        except BaseException:
+            await self.store.release(store_key)
+            raise
+        if 200 <= status < 300:
+            await self.store.complete(store_key, fingerprint, StoredResponse(status, headers, b"".join(chunks)))
+        else:
+            await self.store.release(store_key)
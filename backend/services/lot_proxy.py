@@ -0,0 +1,99 @@
+# services/lot_proxy.py
+import logging
+import os
+from typing import Optional
+from urllib.parse import parse_qs
+
+import httpx
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from services.lots import LotRouter, lots
+
+LOT_PROXY_TIMEOUT = float(os.getenv("LOT_PROXY_TIMEOUT", "30"))  # seconds
+# Set on forwarded requests; an owner that would forward again refuses instead
+PROXIED_HEADER = "x-lot-proxied"
+
+# Not forwarded in either direction
+_HOP_BY_HOP = frozenset({
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"transfer-encoding", b"upgrade", b"host", b"content-length",
+})
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _default_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=LOT_PROXY_TIMEOUT)
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class LotProxyMiddleware:
+    """
+    Forwards requests for a lot owned by another process (?lot_id= naming
+    a lot with a url) to that process and relays its response. Headers,
+    including Authorization, go along unchanged; redirecting instead would
+    lose them, since clients drop credentials on cross-origin redirects.
+    Requests for local or unknown lots reach the app as usual.
+    """
+
+    def __init__(self, app, router: LotRouter = lots, client: Optional[httpx.AsyncClient] = None):
+        self.app = app
+        self.router = router
+        self.client = client
+
+    def _owner_url(self, scope) -> Optional[str]:
+        lot_id = parse_qs(scope["query_string"].decode("latin-1")).get("lot_id", [None])[-1]
+        if not lot_id or lot_id in self.router.shards:
+            return None
+        cfg = self.router.configs.get(lot_id)
+        if cfg is None or not cfg.url:
+            return None
+        if PROXIED_HEADER in Headers(scope=scope):
+            # Already forwarded once: the lot map disagrees between processes
+            return None
+        return cfg.url
+
+    async def __call__(self, scope, receive, send):
+        owner = self._owner_url(scope) if scope["type"] == "http" else None
+        if owner is None:
+            return await self.app(scope, receive, send)
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        url = owner.rstrip("/") + scope["path"]
+        if scope["query_string"]:
+            url += "?" + scope["query_string"].decode("latin-1")
+        headers = [(k, v) for k, v in scope["headers"] if k.lower() not in _HOP_BY_HOP]
+        headers.append((PROXIED_HEADER.encode(), b"1"))
+
+        client = self.client or _default_client()
+        try:
+            resp = await client.send(client.build_request(scope["method"], url, headers=headers,
+                                                          content=body), stream=True)
+        except httpx.HTTPError:
+            logging.exception("Proxying %s %s to %s failed", scope["method"], scope["path"], owner)
+            return await JSONResponse({"detail": "Lot owner is unreachable"},
+                                      status_code=502)(scope, receive, send)
+        try:
+            await send({"type": "http.response.start", "status": resp.status_code,
+                        "headers": [(k, v) for k, v in resp.headers.raw
+                                    if k.lower() not in _HOP_BY_HOP]})
+            async for chunk in resp.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await resp.aclose()
@@ -0,0 +1,151 @@
+# services/lots.py
+import json
+import os
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from utils.logger import LOG_FILE, Journal, journal as default_journal
+from services.booking_engine import BookingEngine
+from services.booking_service import BookingService, BookingView
+from services.response_cache import ResponseCache
+from services.shared_state import (
+    SHARED_STATE, SHM_NAME, SharedOccupancyReader, SharedOccupancyWriter,
+)
+
+# JSON object of lot_id -> {"rows", "cols", "journal", "url"}. Unset means
+# the single 20x20 lot the app started with.
+LOTS = os.getenv("BOOKING_LOTS", "")
+DEFAULT_LOT = os.getenv("BOOKING_DEFAULT_LOT", "default")
+# Comma-separated lots this process owns; empty means every lot without a url
+LOCAL_LOTS = os.getenv("BOOKING_LOCAL_LOTS", "")
+
+
+class LotConfig(NamedTuple):
+    lot_id: str
+    rows: int = 20
+    cols: int = 20
+    journal: Optional[str] = None  # defaults to realtime-<lot>.log next to LOG_FILE
+    url: Optional[str] = None      # base URL of the process owning the lot
+
+
+class LotNotFound(Exception):
+    """No lot with this id is configured."""
+    pass
+
+
+class LotElsewhere(Exception):
+    """The lot is served by another process, reachable at `url`."""
+
+    def __init__(self, lot_id: str, url: str):
+        super().__init__(f"Lot {lot_id} is served at {url}")
+        self.lot_id = lot_id
+        self.url = url
+
+
+def load_lots(spec: str = LOTS, default: str = DEFAULT_LOT) -> Dict[str, LotConfig]:
+    if not spec:
+        return {default: LotConfig(default)}
+    configs = {}
+    for lot_id, opts in json.loads(spec).items():
+        cfg = LotConfig(lot_id, **opts)
+        # Slot and booking ids carry rows and cols as two digits each
+        if not (0 < cfg.rows <= 99 and 0 < cfg.cols <= 99):
+            raise ValueError(f"Lot {lot_id}: rows and cols must be between 1 and 99")
+        configs[lot_id] = cfg
+    return configs
+
+
+class LotShard:
+    """
+    Everything that belongs to one lot: grid, journal, live index,
+    single-writer engine (its own lock domain) and response cache.
+    Lots never share mutable state, so any subset of them can be moved
+    to another process.
+    """
+
+    def __init__(self, config: LotConfig, default: bool = False):
+        self.config = config
+        self.lot_id = config.lot_id
+        if default and config.journal is None:
+            # The default lot keeps the original journal, QR scope and segment
+            journal, scope, shm_name = default_journal, "", SHM_NAME
+        else:
+            path = config.journal or os.path.join(os.path.dirname(LOG_FILE),
+                                                  f"realtime-{config.lot_id}.log")
+            journal, scope, shm_name = Journal(path), config.lot_id, f"{SHM_NAME}_{config.lot_id}"
+        self.qr_scope = scope
+        # Read replicas serve from shared memory and hold no reservation state
+        self.service = BookingService(config.rows, config.cols, journal,
+                                      replay=SHARED_STATE != "reader", lot_id=scope)
+        self.engine = BookingEngine(self.service)
+        self.cache = ResponseCache()
+        self._shm_name = shm_name
+        self.shared_reader = SharedOccupancyReader(shm_name) if SHARED_STATE == "reader" else None
+        self.shared_writer: Optional[SharedOccupancyWriter] = None
+
+    @property
+    def view(self):
+        """What occupancy reads are served from: shared memory or the latest snapshot."""
+        return self.shared_reader or self.engine.snapshot
+
+    @property
+    def snapshot(self) -> BookingView:
+        return self.engine.snapshot
+
+    async def start(self) -> None:
+        await self.engine.start()
+        if SHARED_STATE == "writer" and self.shared_writer is None:
+            self.shared_writer = SharedOccupancyWriter(self.config.rows, self.config.cols,
+                                                       self._shm_name)
+            self.engine.subscribe(self.shared_writer.schedule)
+
+    async def stop(self) -> None:
+        await self.engine.stop()
+        if self.shared_writer is not None:
+            self.shared_writer.close()
+            self.shared_writer = None
+
+
+class LotRouter:
+    """
+    Maps lot ids to shards. Lots listed in `local` are served by this
+    process; other configured lots are reported with the URL of the
+    process that owns them, so a front door can redirect there. Run one
+    process per group of lots with the same BOOKING_LOTS and a different
+    BOOKING_LOCAL_LOTS; a lot's journal must only be written by its owner.
+    """
+
+    def __init__(self, configs: Dict[str, LotConfig], local: Optional[Iterable[str]] = None,
+                 default: str = DEFAULT_LOT):
+        self.configs = configs
+        self.default = default if default in configs else next(iter(configs))
+        # By default a process serves every lot that has no owner URL
+        local = set(local or (lot_id for lot_id, cfg in configs.items() if not cfg.url))
+        unknown = local - set(configs)
+        if unknown:
+            raise ValueError(f"Unknown local lots: {', '.join(sorted(unknown))}")
+        self.shards: Dict[str, LotShard] = {
+            lot_id: LotShard(cfg, default=lot_id == self.default)
+            for lot_id, cfg in configs.items() if lot_id in local
+        }
+
+    def shard(self, lot_id: Optional[str] = None) -> LotShard:
+        lot_id = lot_id or self.default
+        shard = self.shards.get(lot_id)
+        if shard is not None:
+            return shard
+        cfg = self.configs.get(lot_id)
+        if cfg is None or not cfg.url:
+            raise LotNotFound(lot_id)
+        raise LotElsewhere(lot_id, cfg.url)
+
+    async def start(self) -> None:
+        for shard in self.shards.values():
+            await shard.start()
+
+    async def stop(self) -> None:
+        for shard in self.shards.values():
+            await shard.stop()
+
+
+# Shared instance for application
+lots = LotRouter(load_lots(), [lot for lot in LOCAL_LOTS.split(",") if lot])
@@ -0,0 +1,93 @@
+# services/notifications.py
+import asyncio
+import logging
+import os
+from typing import AbstractSet, Dict, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+
+# Comma-separated hosts waitlist callbacks may target. Empty disables
+# callbacks: the server must never be steered at internal addresses.
+CALLBACK_HOSTS = frozenset(h.strip().lower() for h in os.getenv("WAITLIST_CALLBACK_HOSTS", "").split(",")
+                           if h.strip())
+CALLBACK_TIMEOUT = float(os.getenv("WAITLIST_CALLBACK_TIMEOUT", "5"))  # seconds
+CALLBACK_ATTEMPTS = int(os.getenv("WAITLIST_CALLBACK_ATTEMPTS", "3"))
+# Events kept per listening stream before the oldest are dropped
+STREAM_BUFFER = 100
+
+
+def callback_allowed(url: str, hosts: AbstractSet[str] = CALLBACK_HOSTS) -> bool:
+    """http(s) URLs on an allowlisted host only; nothing when the list is empty."""
+    try:
+        parts = urlsplit(url)
+        hostname = parts.hostname
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and hostname is not None and hostname in hosts
+
+
+class Notifier:
+    """
+    Delivers waitlist events to users in two ways:
+      - push to every open event stream of the user in this process;
+      - POST to the callback URL given when joining, retried with backoff
+        (allowlisted hosts only; redirects are not followed).
+    Both are fire-and-forget: a slow or dead client never holds up the
+    booking writer. Events for users with no open stream are not kept.
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, Set[asyncio.Queue]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    # -- push streams ---------------------------------------------------------
+
+    def listen(self, user: str) -> asyncio.Queue:
+        queue = asyncio.Queue(STREAM_BUFFER)
+        self._streams.setdefault(user, set()).add(queue)
+        return queue
+
+    def unlisten(self, user: str, queue: asyncio.Queue) -> None:
+        streams = self._streams.get(user)
+        if streams is not None:
+            streams.discard(queue)
+            if not streams:
+                del self._streams[user]
+
+    def publish(self, user: str, event: dict, callback_url: Optional[str] = None) -> None:
+        for queue in self._streams.get(user, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+        if callback_url and callback_allowed(callback_url):
+            task = asyncio.get_running_loop().create_task(self._post(callback_url, event))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # -- callbacks ------------------------------------------------------------
+
+    async def _post(self, url: str, event: dict) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=CALLBACK_TIMEOUT, follow_redirects=False)
+        for attempt in range(CALLBACK_ATTEMPTS):
+            try:
+                resp = await self._client.post(url, json=event)
+                if resp.status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5 * 2 ** attempt)
+        logging.warning("Waitlist callback to %s failed after %d attempts", url, CALLBACK_ATTEMPTS)
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Shared instance for application
+notifier = Notifier()
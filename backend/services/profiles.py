@@ -0,0 +1,149 @@
+# services/profiles.py
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from utils.mongo import get_db
+
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "30"))  # seconds
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+LOYALTY_FLUSH_INTERVAL = float(os.getenv("LOYALTY_FLUSH_INTERVAL", "5"))  # seconds
+LOYALTY_FLUSH_BATCH = int(os.getenv("LOYALTY_FLUSH_BATCH", "500"))  # users per bulk write
+LOYALTY_POINTS_PER_BOOKING = int(os.getenv("LOYALTY_POINTS_PER_BOOKING", "10"))
+
+
+class ProfileService:
+    """
+    Loyalty points off Mongo's hot path:
+      - reads go through a TTL'd LRU of each user's stored points;
+      - accruals are summed per user in memory and flushed as one
+        unordered bulk write of $inc updates, every LOYALTY_FLUSH_INTERVAL
+        seconds or once LOYALTY_FLUSH_BATCH users are waiting.
+    A read returns stored + pending + in-flight points, so it never
+    lags this worker's own accruals. Flushed deltas are written through
+    to cached entries; other writes to a user invalidate them. The TTL
+    bounds how long another worker's flushes stay invisible here.
+    """
+
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, maxsize: int = PROFILE_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # email -> (expires, stored loyaltyPoints)
+        self._cache: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        # Bumped on every write; a read only caches what it fetched if no
+        # write happened meanwhile
+        self._generation = 0
+        self._pending: Dict[str, int] = {}
+        self._inflight: Dict[str, int] = {}
+        self._flushing: Optional[asyncio.Task] = None
+        self._ticker: Optional[asyncio.Task] = None
+
+    # -- reads ----------------------------------------------------------------
+
+    async def loyalty_points(self, email: str) -> int:
+        hit = self._cache.get(email)
+        if hit is not None and hit[0] > time.monotonic():
+            self._cache.move_to_end(email)
+            stored = hit[1]
+        else:
+            if email in self._inflight:
+                # Mongo may or may not have the delta yet; wait until it does
+                await asyncio.shield(self._flushing)
+            generation = self._generation
+            rec = await get_db()["users"].find_one({"email": email}, {"_id": 0, "loyaltyPoints": 1})
+            if rec is None:
+                return 0
+            stored = rec.get("loyaltyPoints", 0)
+            if generation == self._generation:
+                self._cache[email] = (time.monotonic() + self.ttl, stored)
+                self._cache.move_to_end(email)
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return stored + self._pending.get(email, 0) + self._inflight.get(email, 0)
+
+    def invalidate(self, email: str) -> None:
+        self._cache.pop(email, None)
+        self._generation += 1
+
+    # -- accrual --------------------------------------------------------------
+
+    def accrue(self, email: str, points: int) -> None:
+        """Queue a loyalty-point change; it reaches Mongo with the next flush."""
+        self._pending[email] = self._pending.get(email, 0) + points
+        if len(self._pending) >= LOYALTY_FLUSH_BATCH:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> Optional[asyncio.Task]:
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.get_running_loop().create_task(self._flush())
+        return self._flushing
+
+    async def flush(self) -> None:
+        """Write out everything pending now (waits for a flush in progress first)."""
+        if self._flushing is not None and not self._flushing.done():
+            await self._flushing
+        if self._pending:
+            await self._schedule_flush()
+
+    async def _flush(self) -> None:
+        batch = {email: n for email, n in self._pending.items() if n}
+        self._pending.clear()
+        if not batch:
+            return
+        self._inflight = batch
+        emails = list(batch)
+        try:
+            try:
+                await get_db()["users"].bulk_write(
+                    [UpdateOne({"email": email}, {"$inc": {"loyaltyPoints": batch[email]}})
+                     for email in emails],
+                    ordered=False,
+                )
+                failed = ()
+            except BulkWriteError as e:
+                # Unordered: every update not listed in writeErrors was applied,
+                # so only the listed ones may be retried
+                failed = {emails[err["index"]] for err in e.details.get("writeErrors", ())}
+                logging.error("Loyalty flush: %d of %d updates failed; kept pending",
+                              len(failed), len(emails))
+            except Exception:
+                logging.exception("Loyalty flush failed; %d users kept pending", len(batch))
+                failed = batch
+            for email, n in batch.items():
+                if email in failed:
+                    self._pending[email] = self._pending.get(email, 0) + n
+                    continue
+                hit = self._cache.get(email)
+                if hit is not None:
+                    self._cache[email] = (hit[0], hit[1] + n)
+        finally:
+            self._inflight = {}
+            self._generation += 1
+
+    # -- lifecycle ------------------------------------------------------------
+
+    async def _tick(self) -> None:
+        while True:
+            await asyncio.sleep(LOYALTY_FLUSH_INTERVAL)
+            if self._pending:
+                await self._schedule_flush()
+
+    async def start(self) -> None:
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.get_running_loop().create_task(self._tick())
+
+    async def stop(self) -> None:
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        await self.flush()
+
+
+# Shared instance for application
+profiles = ProfileService()
@@ -0,0 +1,66 @@
+# services/response_cache.py
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Hashable, Optional, Tuple
+
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+CACHE_BUCKET_SECONDS = int(os.getenv("RESPONSE_CACHE_BUCKET_SECONDS", "60"))
+
+
+class ResponseCache:
+    """
+    Bounded LRU of read responses keyed by (endpoint, params, time bucket,
+    state version). Queries within one bucket are answered for the bucket
+    start, so they share one entry. Entries for older versions can never
+    be hit again and are dropped as soon as a newer version is seen.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, bucket_seconds: int = CACHE_BUCKET_SECONDS):
+        self.maxsize = maxsize
+        self.bucket_seconds = bucket_seconds
+        self._entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._version = -1
+
+    def bucket(self, at: datetime) -> datetime:
+        """Start of the time bucket containing `at` (UTC)."""
+        ts = int(at.astimezone(timezone.utc).timestamp())
+        return datetime.fromtimestamp(ts - ts % self.bucket_seconds, timezone.utc)
+
+    def key(self, endpoint: str, params: Hashable, at: datetime, version: int) -> Tuple:
+        return (endpoint, params, int(self.bucket(at).timestamp()), version)
+
+    def etag(self, key: Tuple) -> str:
+        # Unsalted, so every worker serving the same state gives the same
+        # tag. Versions are seeded from the writer's clock and keep
+        # increasing across restarts, so an old tag never matches again.
+        return '"' + hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest() + '"'
+
+    def not_modified(self, if_none_match: Optional[str], etag: str) -> bool:
+        if not if_none_match:
+            return False
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Tuple, value: Any) -> None:
+        version = key[-1]
+        if version > self._version:
+            self._entries.clear()
+            self._version = version
+        elif version < self._version:
+            return  # computed from a stale snapshot
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# Shared instance for application
+cache = ResponseCache()
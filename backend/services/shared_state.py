@@ -0,0 +1,391 @@
+# services/shared_state.py
+import asyncio
+import bisect
+import logging
+import os
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from services.allocator import Rule, occurrence_at
+from services.qr_tokens import parse_slot_id
+
+# "" (single process), "writer" (owns state, publishes) or "reader"
+SHARED_STATE = os.getenv("BOOKING_SHARED_STATE", "")
+SHM_NAME = os.getenv("BOOKING_SHM_NAME", "park_and_ride_occupancy")
+SHM_CAPACITY = int(os.getenv("BOOKING_SHM_CAPACITY", "100000"))  # live bookings
+SHM_RULE_CAPACITY = int(os.getenv("BOOKING_SHM_RULE_CAPACITY", "10000"))  # live recurring rules
+
+# Minimum time between two scheduled publishes (seconds); bursts of
+# writer batches in between are coalesced into the last one
+SHM_PUBLISH_INTERVAL = float(os.getenv("BOOKING_SHM_PUBLISH_INTERVAL", "0.05"))
+
+# How often a reader checks that its segment is still the published one (seconds)
+SHM_RECHECK = float(os.getenv("BOOKING_SHM_RECHECK", "1"))
+
+# Header layout, in int64 words. _EPOCH identifies the writer instance.
+(_SEQ, _VERSION, _VALID, _N_EVENTS, _N_INTERVALS, _ROWS, _COLS, _CAPACITY, _EPOCH,
+ _N_RULES, _RULE_CAPACITY, _N_ZONES) = range(12)
+_HEADER = 12
+
+# A rule record is (slot, start, end, duration seconds, weekday mask, zone
+# index); zone names are stored once each in a small table of fixed-size
+# UTF-8 entries
+_RULE_WORDS = 6
+_ZONES, _ZONE_WORDS = 64, 8
+
+
+class _Tables(NamedTuple):
+    """Arrays a publish copies into the segment, built ahead of the seqlock."""
+    times: array
+    counts: array
+    offsets: array
+    starts: array
+    ends: array
+    rules: array
+    zones: array
+    n_rules: int
+    n_zones: int
+    version: int
+
+
+class SharedStateUnavailable(Exception):
+    """The shared segment is missing or the writer could not publish."""
+    pass
+
+
+def _layout(capacity: int, n_slots: int, rule_capacity: int):
+    """Word offsets of (times, counts, offsets, starts, ends, rules, zones) and total words."""
+    times = _HEADER
+    counts = times + 2 * capacity
+    offsets = counts + 2 * capacity
+    starts = offsets + n_slots + 1
+    ends = starts + capacity
+    rules = ends + capacity
+    zones = rules + _RULE_WORDS * rule_capacity
+    return times, counts, offsets, starts, ends, rules, zones, zones + _ZONES * _ZONE_WORDS
+
+
+def _ts(dt: datetime) -> int:
+    return int(dt.astimezone(timezone.utc).timestamp())
+
+
+def _dt(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc)
+
+
+def _retire(buf) -> None:
+    """Mark a segment as no longer published, so attached readers move on."""
+    buf[_VALID] = 0
+    # Leave the sequence even (a crashed writer may have left it odd) and changed
+    buf[_SEQ] = (buf[_SEQ] | 1) + 1
+
+
+class SharedOccupancyWriter:
+    """
+    Publishes occupancy from the writer process into shared memory:
+      - timeline: sorted change times with the occupied count from each
+        time on, so occupancy_at() is one bisect;
+      - per-slot interval tables: each slot's bookings as sorted start/end
+        arrays addressed through an offsets table;
+      - recurring rules as one compact record each, never expanded here:
+        readers expand them at the queried instant.
+    Updates are wrapped in a seqlock (odd sequence = write in progress).
+    The app publishes through schedule(), which coalesces bursts and
+    builds the arrays off the event loop; the seqlock covers only the copy.
+    Each writer stamps a new epoch into the header and marks the segment
+    invalid when it goes away, so readers re-attach after a restart.
+    """
+
+    def __init__(self, rows: int, cols: int, name: str = SHM_NAME,
+                 capacity: int = SHM_CAPACITY, rule_capacity: int = SHM_RULE_CAPACITY,
+                 publish_interval: float = SHM_PUBLISH_INTERVAL):
+        self.n_slots = rows * cols
+        self.capacity = capacity
+        self.rule_capacity = rule_capacity
+        self.publish_interval = publish_interval
+        self._pending = None
+        self._task: Optional[asyncio.Task] = None
+        self._published = 0.0
+        self._lay = _layout(capacity, self.n_slots, rule_capacity)
+        size = self._lay[-1] * 8
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a previous writer; retire it for readers still
+            # attached, then replace it
+            old = shared_memory.SharedMemory(name=name)
+            old_buf = old.buf.cast("q")
+            _retire(old_buf)
+            old_buf.release()
+            old.close()
+            old.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._buf = self._shm.buf.cast("q")
+        self._buf[_ROWS], self._buf[_COLS] = rows, cols
+        self._buf[_CAPACITY] = capacity
+        self._buf[_RULE_CAPACITY] = rule_capacity
+        self._buf[_EPOCH] = time.time_ns()
+
+    def publish(self, view) -> None:
+        """Write a BookingView into the segment now."""
+        self._write(self._build(view))
+
+    def schedule(self, view) -> None:
+        """
+        Publish `view` soon, from the event loop: at most once per
+        publish_interval, with the tables built in a worker thread so the
+        loop only pays for the copy into the segment. Views that arrive
+        while one is pending replace it.
+        """
+        self._pending = view
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._publish_pending())
+
+    async def _publish_pending(self) -> None:
+        while self._pending is not None:
+            delay = self._published + self.publish_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            view, self._pending = self._pending, None
+            # Views are immutable snapshots, so building from another thread is safe
+            tables = await asyncio.to_thread(self._build, view)
+            self._write(tables)
+            self._published = time.monotonic()
+
+    def _build(self, view) -> Optional[_Tables]:
+        """The segment's contents for a view, or None (logged) if they do not fit."""
+        per_slot = [view.res.bookings(key) for key in view.res.keys()]
+        n = sum(len(lst) for lst in per_slot)
+        rules = [(k, rule) for k, key in enumerate(view.res.keys()) for rule in view.res.rules(key)]
+        zones = list(dict.fromkeys(rule.tz.encode() for _, rule in rules))
+        if n > self.capacity or len(rules) > self.rule_capacity:
+            logging.error("Shared occupancy capacity %d/%d exceeded (%d bookings, %d rules)",
+                          self.capacity, self.rule_capacity, n, len(rules))
+            return None
+        if len(zones) > _ZONES or any(len(z) > 8 * _ZONE_WORDS for z in zones):
+            logging.error("Shared occupancy zone table cannot hold %s", zones)
+            return None
+
+        deltas = {}
+        offsets, starts, ends = array("q", [0]), array("q"), array("q")
+        for lst in per_slot:
+            for b in lst:
+                s, e = _ts(b.start), _ts(b.end)
+                starts.append(s)
+                ends.append(e)
+                deltas[s] = deltas.get(s, 0) + 1
+                deltas[e] = deltas.get(e, 0) - 1
+            offsets.append(len(starts))
+
+        zone_index = {z: i for i, z in enumerate(zones)}
+        records = array("q")
+        for k, rule in rules:
+            records.extend((k, _ts(rule.start), _ts(rule.end), int(rule.duration.total_seconds()),
+                            rule.weekdays, zone_index[rule.tz.encode()]))
+        zone_table = array("q", b"".join(z.ljust(8 * _ZONE_WORDS, b"\0") for z in zones))
+
+        times, counts, running = array("q"), array("q"), 0
+        for t in sorted(deltas):
+            running += deltas[t]
+            times.append(t)
+            counts.append(running)
+        return _Tables(times, counts, offsets, starts, ends, records, zone_table,
+                       len(rules), len(zones), view.version)
+
+    def _write(self, tables: Optional[_Tables]) -> None:
+        buf = self._buf
+        buf[_SEQ] += 1
+        try:
+            if tables is None:
+                buf[_VALID] = 0
+                return
+            o_times, o_counts, o_offsets, o_starts, o_ends, o_rules, o_zones, _ = self._lay
+            buf[o_times:o_times + len(tables.times)] = tables.times
+            buf[o_counts:o_counts + len(tables.counts)] = tables.counts
+            buf[o_offsets:o_offsets + len(tables.offsets)] = tables.offsets
+            buf[o_starts:o_starts + len(tables.starts)] = tables.starts
+            buf[o_ends:o_ends + len(tables.ends)] = tables.ends
+            buf[o_rules:o_rules + len(tables.rules)] = tables.rules
+            buf[o_zones:o_zones + len(tables.zones)] = tables.zones
+            buf[_N_EVENTS] = len(tables.times)
+            buf[_N_INTERVALS] = len(tables.starts)
+            buf[_N_RULES] = tables.n_rules
+            buf[_N_ZONES] = tables.n_zones
+            buf[_VERSION] = tables.version
+            buf[_VALID] = 1
+        finally:
+            buf[_SEQ] += 1
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        _retire(self._buf)
+        self._buf.release()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedOccupancyReader:
+    """
+    Read side used by reader workers: answers the same occupancy queries
+    as BookingView straight from the shared buffer, retrying if the
+    seqlock shows a concurrent write. A segment that turns invalid, or
+    whose name now points at another writer's segment (checked every
+    SHM_RECHECK seconds), is dropped for the current one. Recurring rules
+    are decoded once per published version and expanded per query.
+    """
+    MAX_RETRIES = 1000
+
+    def __init__(self, name: str = SHM_NAME, recheck: float = SHM_RECHECK):
+        self.name = name
+        self.recheck = recheck
+        self._buf = None
+        self._epoch = None
+        self._checked = 0.0
+        # ((epoch, version), slot index -> rules) of the last decoded rule table
+        self._rules: Tuple[Optional[tuple], Dict[int, List[Rule]]] = (None, {})
+
+    def _open(self) -> Optional[shared_memory.SharedMemory]:
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return None
+        # Readers must not unlink the writer's segment on exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    def _detach(self) -> None:
+        if self._buf is not None:
+            self._buf.release()
+            self._shm.close()
+            self._buf = None
+
+    def _adopt(self, shm: shared_memory.SharedMemory) -> None:
+        self._detach()
+        self._shm = shm
+        self._buf = shm.buf.cast("q")
+        self._epoch = self._buf[_EPOCH]
+        self.rows, self.cols = self._buf[_ROWS], self._buf[_COLS]
+        self._lay = _layout(self._buf[_CAPACITY], self.rows * self.cols, self._buf[_RULE_CAPACITY])
+        self._checked = time.monotonic()
+
+    def _reattach(self) -> bool:
+        """Switch to the segment now published under our name; False if it is the same one."""
+        self._checked = time.monotonic()
+        shm = self._open()
+        if shm is None:
+            # Unpublished: frozen data must not be served
+            self._detach()
+            raise SharedStateUnavailable("Shared occupancy state not published yet")
+        probe = shm.buf.cast("q")
+        same = self._buf is not None and probe[_EPOCH] == self._epoch
+        probe.release()
+        if same:
+            shm.close()
+            return False
+        self._adopt(shm)
+        return True
+
+    def _attach(self):
+        if self._buf is None:
+            self._reattach()
+        elif time.monotonic() - self._checked >= self.recheck:
+            self._reattach()
+        return self._buf
+
+    @property
+    def TOTAL(self) -> int:
+        self._attach()
+        return self.rows * self.cols
+
+    def _read(self, fn):
+        for _ in range(self.MAX_RETRIES):
+            buf = self._attach()
+            seq = buf[_SEQ]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            valid = buf[_VALID]
+            try:
+                result = fn(buf) if valid else None
+            except IndexError:
+                # Offsets torn by a concurrent write; the check below retries
+                if buf[_SEQ] == seq:
+                    raise
+                continue
+            if buf[_SEQ] == seq:
+                if valid:
+                    return result
+                # Retired by its writer, or over capacity: only a newer
+                # segment can help
+                if not self._reattach():
+                    raise SharedStateUnavailable("Shared occupancy state is invalid")
+        if self._reattach():
+            return self._read(fn)
+        raise SharedStateUnavailable("Shared occupancy state is busy")
+
+    def _read_with_rules(self, fn):
+        """(fn(buf), slot index -> rules) from one consistent read of the segment."""
+        def read(buf):
+            published = (buf[_EPOCH], buf[_VERSION])
+            raw = None
+            if published != self._rules[0]:
+                o_rules, o_zones = self._lay[5], self._lay[6]
+                raw = (buf[o_rules:o_rules + _RULE_WORDS * buf[_N_RULES]].tolist(),
+                       buf[o_zones:o_zones + _ZONE_WORDS * buf[_N_ZONES]].tobytes())
+            return fn(buf), published, raw
+        result, published, raw = self._read(read)
+        if raw is not None:
+            self._rules = (published, self._decode_rules(*raw))
+        return result, self._rules[1]
+
+    @staticmethod
+    def _decode_rules(records: List[int], zone_table: bytes) -> Dict[int, List[Rule]]:
+        size = 8 * _ZONE_WORDS
+        zones = [zone_table[i:i + size].rstrip(b"\0").decode() for i in range(0, len(zone_table), size)]
+        rules: Dict[int, List[Rule]] = {}
+        for i in range(0, len(records), _RULE_WORDS):
+            k, start, end, duration, weekdays, z = records[i:i + _RULE_WORDS]
+            rules.setdefault(k, []).append(Rule(_dt(start), _dt(end), "", timedelta(seconds=duration),
+                                                weekdays, tz=zones[z]))
+        return rules
+
+    @property
+    def version(self) -> int:
+        return self._read(lambda buf: buf[_VERSION])
+
+    def occupancy_at(self, at: datetime) -> int:
+        t = _ts(at)
+
+        def read(buf):
+            o_times, o_counts = self._lay[0], self._lay[1]
+            n = buf[_N_EVENTS]
+            i = bisect.bisect_right(buf, t, o_times, o_times + n) - o_times - 1
+            return buf[o_counts + i] if i >= 0 else 0
+        booked, rules = self._read_with_rules(read)
+        # A slot is never held by a booking and a rule occurrence at once
+        return booked + sum(1 for lst in rules.values() for rule in lst if occurrence_at(rule, _dt(t)))
+
+    def is_slot_occupied(self, slot_id: str, at: datetime) -> bool:
+        self._attach()
+        key = parse_slot_id(slot_id)
+        if key is None or not (0 <= key[0] < self.rows and 0 <= key[1] < self.cols):
+            return False
+        k = key[0] * self.cols + key[1]
+        t = _ts(at)
+
+        def read(buf):
+            o_offsets, o_starts, o_ends = self._lay[2], self._lay[3], self._lay[4]
+            lo = o_starts + buf[o_offsets + k]
+            hi = o_starts + buf[o_offsets + k + 1]
+            i = bisect.bisect_right(buf, t, lo, hi)
+            return i > lo and buf[o_ends + (i - 1 - o_starts)] > t
+        booked, rules = self._read_with_rules(read)
+        return booked or any(occurrence_at(rule, _dt(t)) for rule in rules.get(k, ()))
+
+
+def make_reader() -> Optional[SharedOccupancyReader]:
+    return SharedOccupancyReader() if SHARED_STATE == "reader" else None
@@ -0,0 +1,122 @@
+# services/waitlist.py
+import bisect
+import heapq
+import itertools
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# A request waiting for a slot over [start, end). subscriber entries are
+# served before everyone else; ties go to whoever joined first.
+WaitlistEntry = namedtuple("WaitlistEntry", [
+    "entry_id", "start", "end", "plate", "user", "subscriber", "callback_url",
+])
+
+Window = Tuple[datetime, datetime]
+
+
+class Waitlist:
+    """
+    Waiting requests grouped by time window; each window is a priority
+    queue ordered by (non-subscriber, arrival). Windows are also kept
+    sorted by start so a freed interval finds the windows it overlaps
+    with one bisect. Removal is lazy: heaps skip entries no longer listed.
+    """
+
+    def __init__(self):
+        self._queues: Dict[Window, List[Tuple[int, int, str]]] = {}
+        self._windows: List[Window] = []
+        self._entries: Dict[str, WaitlistEntry] = {}
+        # user -> ids of their live entries, in arrival order
+        self._by_user: Dict[str, Dict[str, None]] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, entry_id: str) -> Optional[WaitlistEntry]:
+        return self._entries.get(entry_id)
+
+    def add(self, start: datetime, end: datetime, plate: str, user: str,
+            subscriber: bool = False, callback_url: Optional[str] = None) -> WaitlistEntry:
+        entry = WaitlistEntry(uuid.uuid4().hex[:16], start, end, plate, user,
+                              subscriber, callback_url)
+        window = (start, end)
+        queue = self._queues.get(window)
+        if queue is None:
+            queue = self._queues[window] = []
+            bisect.insort(self._windows, window)
+        heapq.heappush(queue, (0 if subscriber else 1, next(self._seq), entry.entry_id))
+        self._entries[entry.entry_id] = entry
+        self._by_user.setdefault(user, {})[entry.entry_id] = None
+        return entry
+
+    def remove(self, entry_id: str) -> Optional[WaitlistEntry]:
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._forget(entry)
+            self._prune((entry.start, entry.end))
+        return entry
+
+    def _forget(self, entry: WaitlistEntry) -> None:
+        ids = self._by_user[entry.user]
+        ids.pop(entry.entry_id, None)
+        if not ids:
+            del self._by_user[entry.user]
+
+    def _prune(self, window: Window) -> None:
+        # Pop dead heads; drop the window once nothing live is left
+        queue = self._queues.get(window)
+        while queue and queue[0][2] not in self._entries:
+            heapq.heappop(queue)
+        if queue is not None and not queue:
+            del self._queues[window]
+            self._windows.pop(bisect.bisect_left(self._windows, window))
+
+    def position(self, entry_id: str) -> Optional[int]:
+        """1-based place in its window's queue, or None once it has left."""
+        entry = self._entries.get(entry_id)
+        queue = entry and self._queues.get((entry.start, entry.end))
+        mine = next((item for item in queue or () if item[2] == entry_id), None)
+        if mine is None:
+            return None
+        return 1 + sum(1 for item in queue if item < mine and item[2] in self._entries)
+
+    def for_user(self, user: str) -> List[WaitlistEntry]:
+        return [self._entries[i] for i in self._by_user.get(user, ())]
+
+    def count_for(self, user: str) -> int:
+        return len(self._by_user.get(user, ()))
+
+    def candidates(self, start: datetime, end: datetime) -> Iterator[WaitlistEntry]:
+        """
+        Live entries whose window overlaps [start, end), best first across
+        windows. Entries removed while iterating are skipped.
+        """
+        hi = bisect.bisect_left(self._windows, (end,))
+        items = []
+        for window in self._windows[:hi]:
+            if window[1] > start:
+                items.extend(self._queues[window])
+        for _, _, entry_id in sorted(items):
+            entry = self._entries.get(entry_id)
+            if entry is not None:
+                yield entry
+
+    def expire(self, now: datetime) -> List[WaitlistEntry]:
+        """Drop entries whose window has started; returns them."""
+        hi = bisect.bisect_left(self._windows, (now,))
+        # Windows starting exactly at `now` have started too
+        while hi < len(self._windows) and self._windows[hi][0] <= now:
+            hi += 1
+        dropped = []
+        for window in self._windows[:hi]:
+            for _, _, entry_id in self._queues[window]:
+                entry = self._entries.pop(entry_id, None)
+                if entry is not None:
+                    self._forget(entry)
+                    dropped.append(entry)
+            del self._queues[window]
+        del self._windows[:hi]
+        return dropped
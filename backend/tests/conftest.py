@@ -0,0 +1,54 @@
+# tests/conftest.py
+import os
+import tempfile
+
+# Configure the app for offline runs before anything imports it
+_tmp = tempfile.mkdtemp(prefix="park-and-ride-tests-")
+os.environ.setdefault("MONGO_URI", "memory://")
+os.environ.setdefault("BOOKING_LOG_FILE", os.path.join(_tmp, "realtime.log"))
+os.environ.setdefault("ADMISSION_BACKEND", "off")
+
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from auth.auth_utils import create_access_token
+from services.booking_service import BookingService
+from utils.logger import Journal
+
+
+def future(days: int = 1, hour: int = 8) -> datetime:
+    """A whole hour `days` from today (UTC), always in the future."""
+    day = datetime.now(timezone.utc) + timedelta(days=days)
+    return day.replace(hour=hour, minute=0, second=0, microsecond=0)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return Journal(str(tmp_path / "journal.log"))
+
+
+@pytest.fixture
+def service(journal):
+    return BookingService(2, 2, journal, replay=False)
+
+
+def auth(user: str, role: str = None) -> dict:
+    """Bearer header for `user` (with `role`, if given), without going through bcrypt."""
+    claims = {"sub": user, **({"role": role} if role else {})}
+    return {"Authorization": f"Bearer {create_access_token(claims)}"}
+
+
+@pytest_asyncio.fixture
+async def api():
+    """Client for the whole app, with startup and shutdown hooks run."""
+    from main import app
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                     base_url="http://test") as client:
+            yield client
+    finally:
+        await app.router.shutdown()
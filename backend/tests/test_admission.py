@@ -0,0 +1,51 @@
+# tests/test_admission.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.admission import MemoryCounters, MongoCounters
+
+
+class RecordingCollection:
+    """Records MongoCounters' calls and grants every take."""
+
+    def __init__(self):
+        self.indexes = []
+        self.updates = []
+
+    async def create_index(self, field, **kwargs):
+        self.indexes.append((field, kwargs))
+
+    async def find_one_and_update(self, flt, pipeline, **kwargs):
+        self.updates.append((flt, pipeline, kwargs))
+        return {"granted": True, "tokens": 1}
+
+
+@pytest.mark.asyncio
+async def test_mongo_buckets_expire_once_full_again():
+    coll = RecordingCollection()
+    counters = MongoCounters(coll)
+    before = datetime.now(timezone.utc)
+    assert await counters.take("book:ip:1.2.3.4", rate=2.0, burst=20) == 0
+    await counters.take("book:ip:1.2.3.4", rate=2.0, burst=20)
+    assert coll.indexes == [("expiresAt", {"expireAfterSeconds": 0})]
+    flt, pipeline, kwargs = coll.updates[0]
+    assert flt == {"_id": "book:ip:1.2.3.4"} and kwargs["upsert"]
+    expires = pipeline[0]["$set"]["expiresAt"]
+    # 20 tokens at 2/s: full again after 10 seconds
+    assert before + timedelta(seconds=10) <= expires <= datetime.now(timezone.utc) + timedelta(seconds=10)
+
+
+@pytest.mark.asyncio
+async def test_memory_bucket_refill_and_eviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.admission.time.monotonic", lambda: now[0])
+    counters = MemoryCounters(max_subjects=2)
+    assert [await counters.take("a", 1.0, 2) for _ in range(2)] == [0, 0]
+    assert await counters.take("a", 1.0, 2) == pytest.approx(1.0)
+    now[0] += 1
+    assert await counters.take("a", 1.0, 2) == 0
+    await counters.take("b", 1.0, 2)
+    await counters.take("c", 1.0, 2)
+    # "a" was least recently seen and comes back with a full bucket
+    assert [await counters.take("a", 1.0, 2) for _ in range(2)] == [0, 0]
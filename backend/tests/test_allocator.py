@@ -0,0 +1,90 @@
+# tests/test_allocator.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.allocator import Booking, BestFit, FirstFit, SlotIndex, ZoneAffinity, make_strategy
+from utils.allocation_sim import demand_trace, simulate
+
+MON = datetime(2030, 1, 7, 8, tzinfo=timezone.utc)
+
+
+def test_enclosing_gap_between_bookings():
+    idx = SlotIndex(1, 1)
+    idx.add((0, 0), Booking(MON, MON + timedelta(hours=2), "A"))
+    idx.add((0, 0), Booking(MON + timedelta(hours=6), MON + timedelta(hours=8), "B"))
+    s, e = MON + timedelta(hours=3), MON + timedelta(hours=4)
+    assert idx.enclosing_gap((0, 0), s, e) == (MON + timedelta(hours=2), MON + timedelta(hours=6))
+    assert idx.enclosing_gap((0, 0), MON + timedelta(hours=1), e) is None
+    assert idx.enclosing_gap((0, 0), s, MON + timedelta(hours=7)) is None
+    # Back to back with a booking is not a conflict
+    assert idx.enclosing_gap((0, 0), MON + timedelta(hours=2), MON + timedelta(hours=6)) is not None
+
+
+def test_enclosing_gap_open_sides():
+    idx = SlotIndex(1, 1)
+    assert idx.enclosing_gap((0, 0), MON, MON + timedelta(hours=1)) == (None, None)
+
+
+def test_strategies():
+    idx = SlotIndex(1, 2)
+    idx.add((0, 1), Booking(MON, MON + timedelta(hours=2), "A"))
+    s, e = MON + timedelta(hours=2), MON + timedelta(hours=4)
+    assert FirstFit().choose(idx, s, e) == (0, 0)
+    # Best fit packs next to the existing booking
+    assert BestFit().choose(idx, s, e) == (0, 1)
+
+
+def test_remove_and_snapshot_isolation():
+    idx = SlotIndex(1, 1)
+    b = Booking(MON, MON + timedelta(hours=2), "A")
+    idx.add((0, 0), b)
+    snap = idx.snapshot()
+    assert idx.remove((0, 0), b)
+    assert not idx.remove((0, 0), b)
+    assert snap.at((0, 0), MON) == b
+    assert idx.at((0, 0), MON) is None
+
+
+def test_best_fit_prefers_the_tightest_bounded_gap():
+    idx = SlotIndex(1, 3)
+    h = lambda n: MON + timedelta(hours=n)
+    # Slot 0: free from 2h on; slot 1: 2h-8h; slot 2: exactly 2h-4h
+    idx.add((0, 0), Booking(MON, h(2), "A"))
+    idx.add((0, 1), Booking(MON, h(2), "B"))
+    idx.add((0, 1), Booking(h(8), h(9), "C"))
+    idx.add((0, 2), Booking(MON, h(2), "D"))
+    idx.add((0, 2), Booking(h(4), h(5), "E"))
+    assert BestFit().choose(idx, h(2), h(4)) == (0, 2)
+    assert BestFit().choose(idx, h(2), h(6)) == (0, 1)
+    assert BestFit().choose(idx, h(2), h(12)) == (0, 0)
+    assert BestFit().choose(idx, MON, h(1)) is None
+
+
+def test_zone_affinity_keeps_durations_in_their_band():
+    idx = SlotIndex(4, 1)
+    zone = ZoneAffinity(4, 1)
+    # Rows 0-1 short stays, row 2 up to a week, row 3 longer
+    assert zone.choose(idx, MON, MON + timedelta(hours=3)) == (0, 0)
+    assert zone.choose(idx, MON, MON + timedelta(days=3)) == (2, 0)
+    assert zone.choose(idx, MON, MON + timedelta(days=30)) == (3, 0)
+    # A full band falls back to the rest of the lot
+    idx.add((3, 0), Booking(MON, MON + timedelta(days=31), "M"))
+    assert zone.choose(idx, MON, MON + timedelta(days=30)) == (0, 0)
+
+
+def test_make_strategy():
+    assert isinstance(make_strategy("first-fit", 2, 2), FirstFit)
+    assert isinstance(make_strategy("best-fit", 2, 2), BestFit)
+    assert isinstance(make_strategy("zone", 2, 2), ZoneAffinity)
+    with pytest.raises(ValueError):
+        make_strategy("worst-fit", 2, 2)
+
+
+def test_simulation_accounts_for_every_request():
+    base = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    trace = demand_trace(400, 1, base)
+    for name in ("first-fit", "best-fit", "zone"):
+        report = simulate(name, trace, base)
+        assert sum(offered for _, offered in report["accepted"].values()) == len(trace)
+        assert 0 < report["utilization"] <= 1
@@ -0,0 +1,104 @@
+# tests/test_bookings.py
+import uuid
+from datetime import timedelta
+
+import pytest
+
+from services.booking_service import BookingNotFound, BookingService
+from tests.conftest import auth, future
+
+
+def test_cancel_requires_owner(service):
+    slot, start, end, _ = service.book(future(), 2, 0, 0, "abc1", owner="a@x.io")
+    bid = service.booking_id(*slot, start, end)
+    with pytest.raises(BookingNotFound):
+        service.cancel_by_id(bid, "b@x.io")
+    with pytest.raises(BookingNotFound):
+        service.cancel(*slot, start, end, "ABC1", "b@x.io")
+    assert service.bookings_for_plate("ABC1", "b@x.io") == []
+    assert len(service.bookings_for_plate("ABC1", "a@x.io")) == 1
+    assert service.cancel_by_id(bid, "a@x.io").owner == "a@x.io"
+
+
+def test_owner_survives_journal_replay(service, journal):
+    start = future()
+    service.book(start, 2, 0, 0, "A1", owner="odd user+1@x.io")
+    slot, rule, _ = service.book_recurring(start + timedelta(days=1), 2, [0, 1, 2, 3, 4, 5, 6],
+                                           start + timedelta(days=5), "R1", owner="r@x.io")
+    service.book(start, 2, 0, 0, "LEGACY")
+    replayed = BookingService(2, 2, journal)
+    [(_, b)] = replayed.bookings_for_plate("A1")
+    assert b.owner == "odd user+1@x.io"
+    [(_, r)] = replayed.bookings_for_plate("R1")
+    assert r == rule
+    [(_, legacy)] = replayed.bookings_for_plate("LEGACY")
+    assert legacy.owner == ""
+    # A cancellation replays against the owned booking it names
+    replayed.cancel_by_id(replayed.booking_id(*slot, rule.start, rule.end), "r@x.io")
+    assert BookingService(2, 2, journal).bookings_for_plate("R1") == []
+
+
+@pytest.mark.asyncio
+async def test_other_users_cannot_list_or_cancel(api):
+    plate = f"P{uuid.uuid4().hex[:6]}"
+    a, b = auth("a@x.io"), auth("b@x.io")
+    resp = await api.post("/book", json={"start": future(3).isoformat(), "hours": 2, "plate": plate},
+                          headers=a)
+    assert resp.status_code == 200
+    booked = resp.json()
+
+    listed = await api.get("/bookings", params={"plate": plate}, headers=b)
+    assert listed.json() == {"bookings": []}
+    resp = await api.delete(f"/bookings/{booked['booking_id']}", headers=b)
+    assert resp.status_code == 404
+    resp = await api.post("/cancel", json={"row": booked["slot"]["row"], "col": booked["slot"]["col"],
+                                           "start": booked["start"], "end": booked["end"],
+                                           "plate": plate}, headers=b)
+    assert resp.status_code == 404
+
+    listed = await api.get("/bookings", params={"plate": plate}, headers=a)
+    assert [x["booking_id"] for x in listed.json()["bookings"]] == [booked["booking_id"]]
+    resp = await api.delete(f"/bookings/{booked['booking_id']}", headers=a)
+    assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_staff_can_list_and_cancel_any_booking(api):
+    from main import get_shard
+
+    plate = f"S{uuid.uuid4().hex[:6]}"
+    staff = auth("desk@x.io", role="staff")
+    resp = await api.post("/book", json={"start": future(3).isoformat(), "hours": 2, "plate": plate},
+                          headers=auth("a@x.io"))
+    owned = resp.json()["booking_id"]
+    # Booked before owners were recorded: no account can reach it
+    shard = get_shard(None)
+    slot, start, end, _ = await shard.engine.book(future(4), 2, 0, 0, plate)
+    legacy = shard.service.booking_id(*slot, start, end)
+
+    listed = await api.get("/bookings", params={"plate": plate}, headers=staff)
+    assert [x["booking_id"] for x in listed.json()["bookings"]] == [owned, legacy]
+    listed = await api.get("/bookings", params={"plate": plate}, headers=auth("a@x.io", role="driver"))
+    [b] = listed.json()["bookings"]
+    assert b["booking_id"] == owned
+
+    resp = await api.delete(f"/bookings/{legacy}", headers=staff)
+    assert resp.status_code == 200
+    resp = await api.post("/cancel", json={"row": b["slot"]["row"], "col": b["slot"]["col"],
+                                           "start": b["start"], "end": b["end"], "plate": plate},
+                          headers=staff)
+    assert resp.status_code == 200
+    listed = await api.get("/bookings", params={"plate": plate}, headers=staff)
+    assert listed.json() == {"bookings": []}
+
+
+@pytest.mark.asyncio
+async def test_login_carries_the_staff_role(api):
+    from auth.auth_utils import decode_access_token
+    from utils.mongo import get_db
+
+    creds = {"email": "gate@x.io", "password": "password123"}
+    assert (await api.post("/auth/register", json=creds)).status_code in (200, 201)
+    await get_db()["users"].update_one({"email": "gate@x.io"}, {"$set": {"role": "staff"}})
+    token = (await api.post("/auth/login", json=creds)).json()["access_token"]
+    assert decode_access_token(token)["role"] == "staff"
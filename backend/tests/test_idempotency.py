@@ -0,0 +1,152 @@
+# tests/test_idempotency.py
+import asyncio
+import json
+import uuid
+
+import httpx
+import pytest
+import stripe
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from services.idempotency import (
+    DONE, MISMATCH, NEW, PENDING, IdempotencyMiddleware, MemoryIdempotencyStore, StoredResponse,
+)
+from tests.conftest import auth, future
+from utils.fake_stripe import FakeStripe
+
+OK = StoredResponse(200, [(b"content-type", b"application/json")], b"{}")
+
+
+@pytest.mark.asyncio
+async def test_store_state_machine():
+    store = MemoryIdempotencyStore()
+    assert await store.begin("k", "fp") == (NEW, None)
+    assert await store.begin("k", "fp") == (PENDING, None)
+    assert await store.begin("k", "other") == (MISMATCH, None)
+    await store.complete("k", "fp", OK)
+    assert await store.begin("k", "fp") == (DONE, OK)
+    assert await store.begin("k", "other") == (MISMATCH, None)
+
+
+@pytest.mark.asyncio
+async def test_store_release_and_expiry():
+    store = MemoryIdempotencyStore(ttl=0)
+    await store.begin("k", "fp")
+    await store.release("k")
+    assert await store.begin("k", "fp") == (NEW, None)
+    await store.complete("k", "fp", OK)
+    # ttl=0: the stored response is already gone
+    assert await store.begin("k", "fp") == (NEW, None)
+
+
+@pytest.mark.asyncio
+async def test_store_evicts_oldest_beyond_max_keys():
+    store = MemoryIdempotencyStore(max_keys=2)
+    for key in "abc":
+        await store.begin(key, "fp")
+        await store.complete(key, "fp", OK)
+    assert await store.begin("a", "fp") == (NEW, None)
+    assert await store.begin("c", "fp") == (DONE, OK)
+
+
+def _client(release: asyncio.Event = None):
+    calls = []
+
+    async def book(request: Request):
+        body = await request.json()
+        calls.append(body)
+        if release is not None:
+            await release.wait()
+        status = 400 if body.get("fail") else 200
+        return JSONResponse({"n": len(calls)}, status_code=status)
+
+    app = IdempotencyMiddleware(Starlette(routes=[Route("/book", book, methods=["POST"])]),
+                                store=MemoryIdempotencyStore())
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    return client, calls
+
+
+@pytest.mark.asyncio
+async def test_middleware_replays_success():
+    client, calls = _client()
+    async with client:
+        h = {"Idempotency-Key": "k1"}
+        r1 = await client.post("/book", json={"plate": "A"}, headers=h)
+        r2 = await client.post("/book", json={"plate": "A"}, headers=h)
+        assert r1.json() == r2.json() == {"n": 1}
+        assert r2.headers["idempotent-replayed"] == "true"
+        assert "idempotent-replayed" not in r1.headers
+        # Same key, different body
+        r3 = await client.post("/book", json={"plate": "B"}, headers=h)
+        assert r3.status_code == 422
+        # No key: runs every time
+        await client.post("/book", json={"plate": "A"})
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_middleware_does_not_store_failures():
+    client, calls = _client()
+    async with client:
+        h = {"Idempotency-Key": "k1"}
+        assert (await client.post("/book", json={"fail": 1}, headers=h)).status_code == 400
+        assert (await client.post("/book", json={"fail": 1}, headers=h)).status_code == 400
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_middleware_conflict_while_pending():
+    release = asyncio.Event()
+    client, calls = _client(release)
+    async with client:
+        h = {"Idempotency-Key": "k1"}
+        first = asyncio.create_task(client.post("/book", json={"plate": "A"}, headers=h))
+        while not calls:
+            await asyncio.sleep(0)
+        second = await client.post("/book", json={"plate": "A"}, headers=h)
+        assert second.status_code == 409
+        assert second.headers["retry-after"] == "1"
+        release.set()
+        assert (await first).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_middleware_rejects_long_keys():
+    client, calls = _client()
+    async with client:
+        r = await client.post("/book", json={}, headers={"Idempotency-Key": "x" * 256})
+    assert r.status_code == 400
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_book_retry_is_replayed_by_the_app(api):
+    plate = f"I{uuid.uuid4().hex[:6]}"
+    req = {"start": future(6).isoformat(), "hours": 1, "plate": plate}
+    key = {"Idempotency-Key": uuid.uuid4().hex}
+    first = await api.post("/book", json=req, headers={**auth("a@x.io"), **key})
+    retry = await api.post("/book", json=req, headers={**auth("a@x.io"), **key})
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    listed = await api.get("/bookings", params={"plate": plate}, headers=auth("a@x.io"))
+    assert len(listed.json()["bookings"]) == 1
+    # Keys are per caller: another account's request with the same key runs
+    other = await api.post("/book", json=req, headers={**auth("b@x.io"), **key})
+    assert other.status_code == 200 and "idempotent-replayed" not in other.headers
+
+
+@pytest.mark.asyncio
+async def test_payment_intent_retry_calls_stripe_once(api, monkeypatch):
+    fake = FakeStripe(latency=0, jitter=0)
+    monkeypatch.setattr(stripe.PaymentIntent, "create", fake.create_intent)
+    req = {"amount_cents": 2000, "metadata": {"plate": "IPAY1"}}
+    key = {"Idempotency-Key": uuid.uuid4().hex}
+    first = await api.post("/payments/create-intent", json=req, headers=key)
+    retry = await api.post("/payments/create-intent", json=req, headers=key)
+    assert first.status_code == 200
+    assert retry.json() == first.json()
+    assert fake.calls == 1
@@ -0,0 +1,68 @@
+# tests/test_lot_proxy.py
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from services.lot_proxy import PROXIED_HEADER, LotProxyMiddleware
+from services.lots import LotConfig, LotRouter
+
+ROUTER = LotRouter({"here": LotConfig("here", rows=1, cols=1),
+                    "east": LotConfig("east", rows=1, cols=1, url="http://east:8004/")},
+                   local=["here"], default="here")
+
+
+async def echo(request: Request):
+    return JSONResponse({
+        "who": request.url.hostname,
+        "method": request.method,
+        "path": request.url.path,
+        "query": request.url.query,
+        "authorization": request.headers.get("authorization"),
+        "proxied": request.headers.get(PROXIED_HEADER),
+        "body": (await request.body()).decode(),
+    }, status_code=201, headers={"x-owner": "yes"})
+
+
+def _echo_app():
+    return Starlette(routes=[Route("/book", echo, methods=["GET", "POST", "DELETE"])])
+
+
+def _client():
+    owner = httpx.AsyncClient(transport=httpx.ASGITransport(app=_echo_app()))
+    app = LotProxyMiddleware(_echo_app(), ROUTER, client=owner)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://front")
+
+
+@pytest.mark.asyncio
+async def test_remote_lot_is_forwarded_with_credentials():
+    async with _client() as client:
+        resp = await client.post("/book?lot_id=east", content=b'{"plate": "A"}',
+                                 headers={"Authorization": "Bearer t0k"})
+    assert resp.status_code == 201
+    assert resp.headers["x-owner"] == "yes"
+    assert resp.json() == {"who": "east", "method": "POST", "path": "/book", "query": "lot_id=east",
+                           "authorization": "Bearer t0k", "proxied": "1", "body": '{"plate": "A"}'}
+
+
+@pytest.mark.asyncio
+async def test_local_unknown_and_already_forwarded_lots_stay_here():
+    async with _client() as client:
+        for query, headers in (("?lot_id=here", {}), ("?lot_id=nowhere", {}), ("", {}),
+                               ("?lot_id=east", {PROXIED_HEADER: "1"})):
+            resp = await client.get("/book" + query, headers=headers)
+            assert resp.json()["who"] == "front", query
+
+
+@pytest.mark.asyncio
+async def test_unreachable_owner_is_a_502():
+    def refuse(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    owner = httpx.AsyncClient(transport=httpx.MockTransport(refuse))
+    app = LotProxyMiddleware(_echo_app(), ROUTER, client=owner)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://front") as client:
+        resp = await client.get("/book?lot_id=east")
+    assert resp.status_code == 502
@@ -0,0 +1,66 @@
+# tests/test_loyalty.py
+import uuid
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from services.profiles import LOYALTY_POINTS_PER_BOOKING, profiles
+from tests.conftest import auth, future
+from utils.mongo import get_db
+
+
+async def _user() -> str:
+    email = f"{uuid.uuid4().hex[:8]}@x.io"
+    await get_db()["users"].insert_one({"email": email, "hashed_password": "-", "loyaltyPoints": 0})
+    profiles.invalidate(email)
+    return email
+
+
+async def _points(api, user: str) -> int:
+    await profiles.flush()
+    profiles.invalidate(user)
+    return (await api.get("/auth/me", headers=auth(user))).json()["loyaltyPoints"]
+
+
+@pytest.mark.asyncio
+async def test_cancel_debits_the_owner(api):
+    a, b = await _user(), await _user()
+    booked = (await api.post("/book", json={"start": future(5).isoformat(), "hours": 1, "plate": "PTS1"},
+                             headers=auth(a))).json()
+    assert await _points(api, a) == LOYALTY_POINTS_PER_BOOKING
+
+    # Someone else cannot cancel it, and loses nothing trying
+    resp = await api.delete(f"/bookings/{booked['booking_id']}", headers=auth(b))
+    assert resp.status_code == 404
+    assert await _points(api, b) == 0
+    assert await _points(api, a) == LOYALTY_POINTS_PER_BOOKING
+
+    resp = await api.delete(f"/bookings/{booked['booking_id']}", headers=auth(a))
+    assert resp.status_code == 200
+    assert await _points(api, a) == 0
+    assert await _points(api, b) == 0
+
+
+@pytest.mark.asyncio
+async def test_partial_flush_failure_retries_only_failed_updates(monkeypatch):
+    a, b = await _user(), await _user()
+    users = get_db()["users"]
+    bulk_write = users.bulk_write
+
+    async def fail_for_b(requests, ordered=True):
+        # Unordered bulk write: apply what succeeds, report the rest
+        ok = [op for op in requests if op._filter["email"] != b]
+        await bulk_write(ok, ordered=ordered)
+        raise BulkWriteError({"writeErrors": [{"index": i, "code": 11000, "errmsg": "boom"}
+                                              for i, op in enumerate(requests)
+                                              if op._filter["email"] == b],
+                              "nInserted": 0, "nModified": len(ok)})
+
+    monkeypatch.setattr(users, "bulk_write", fail_for_b)
+    profiles.accrue(a, 10)
+    profiles.accrue(b, 10)
+    await profiles.flush()
+    monkeypatch.setattr(users, "bulk_write", bulk_write)
+    await profiles.flush()
+    for email in (a, b):
+        assert (await users.find_one({"email": email}))["loyaltyPoints"] == 10
@@ -0,0 +1,93 @@
+# tests/test_qr_tokens.py
+from datetime import timedelta
+
+import pytest
+
+from services.booking_service import BookingService
+from services.qr_tokens import sign_qr, verify_qr
+from tests.conftest import auth, future
+
+
+def test_signature_window_and_lot_scope(service):
+    start = future()
+    token = sign_qr(1, 2, start, start + timedelta(hours=2), "ABC1", "north", serial=7)
+    inside = start + timedelta(minutes=5)
+    verdict = verify_qr(token, inside, lot_id="north")
+    assert verdict.valid and verdict.plate == "ABC1"
+    assert verdict.booking_id == service.booking_id(1, 2, start, start + timedelta(hours=2))
+    assert verify_qr(token, inside).reason == "bad signature"
+    assert verify_qr(token, start - timedelta(minutes=1), lot_id="north").reason == "not yet valid"
+    assert verify_qr(token, start + timedelta(hours=2), lot_id="north").reason == "expired"
+    assert verify_qr(token.replace("ABC1", "ABC2"), inside, lot_id="north").reason == "bad signature"
+
+
+def test_tokens_without_serial_still_verify():
+    start = future()
+    token = sign_qr(0, 0, start, start + timedelta(hours=1), "AB-12")
+    verdict = verify_qr(token, start)
+    assert verdict.valid and verdict.plate == "AB-12"
+
+
+def _verdict(svc: BookingService, token: str, at):
+    snap = svc.snapshot()
+    return verify_qr(token, at, snap.revoked, svc.lot_id, snap.schedules)
+
+
+def test_rebooking_does_not_revive_a_cancelled_token(service):
+    start = future()
+    slot, _, end, old = service.book(start, 2, 0, 0, "ABC1", owner="a@x.io")
+    service.cancel_by_id(service.booking_id(*slot, start, end), "a@x.io")
+    assert _verdict(service, old, start).reason == "revoked"
+
+    # Another plate lands on the same slot and window
+    slot2, _, _, new = service.book(start, 2, 0, 0, "ZZ9", owner="b@x.io")
+    assert slot2 == slot
+    assert _verdict(service, old, start).reason == "revoked"
+    assert _verdict(service, new, start).valid
+
+    # Even the same plate and account rebooking gets a distinct token
+    service.cancel_by_id(service.booking_id(*slot, start, end), "b@x.io")
+    slot3, _, _, again = service.book(start, 2, 0, 0, "ABC1", owner="a@x.io")
+    assert slot3 == slot and again != old
+    assert _verdict(service, old, start).reason == "revoked"
+    assert _verdict(service, again, start).valid
+
+
+def test_revocations_survive_replay(service, journal):
+    start = future()
+    slot, _, end, old = service.book(start, 2, 0, 0, "ABC1", owner="a@x.io")
+    service.cancel_by_id(service.booking_id(*slot, start, end), "a@x.io")
+    _, _, _, new = service.book(start, 2, 0, 0, "ZZ9", owner="b@x.io")
+    replayed = BookingService(2, 2, journal)
+    assert _verdict(replayed, old, start).reason == "revoked"
+    assert _verdict(replayed, new, start).valid
+
+
+def test_revocation_dropped_once_the_window_ends(service):
+    start = future()
+    slot, _, end, old = service.book(start, 1, 0, 0, "ABC1", owner="a@x.io")
+    service.cancel_by_id(service.booking_id(*slot, start, end), "a@x.io")
+    assert service.revoked
+    service.expire(end)
+    assert not service.revoked
+
+
+def test_recurring_token_outside_schedule(service):
+    start = future()
+    _, rule, qr = service.book_recurring(start, 2, [start.weekday()], start + timedelta(days=14),
+                                         "R1", owner="r@x.io")
+    assert _verdict(service, qr, start + timedelta(hours=1)).valid
+    assert _verdict(service, qr, start + timedelta(days=1, hours=1)).reason == "outside schedule"
+
+
+@pytest.mark.asyncio
+async def test_gate_after_cancel_and_rebook(api):
+    start = future(4).isoformat()
+    a, b = auth("a@x.io"), auth("b@x.io")
+    first = (await api.post("/book", json={"start": start, "hours": 2, "plate": "GATE1"}, headers=a)).json()
+    await api.delete(f"/bookings/{first['booking_id']}", headers=a)
+    second = (await api.post("/book", json={"start": start, "hours": 2, "plate": "GATE2"}, headers=b)).json()
+    assert second["booking_id"] == first["booking_id"]
+    resp = await api.post("/gate/verify", json={"tokens": [first["qr"], second["qr"]], "at": start},
+                          headers=b)
+    assert [(v["valid"], v["reason"]) for v in resp.json()["results"]] == [(False, "revoked"), (True, None)]
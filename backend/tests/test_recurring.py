@@ -0,0 +1,156 @@
+# tests/test_recurring.py
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from services.allocator import Booking, Rule, SlotIndex, choose_rule_slot, occurrence_at, occurrences
+from services.booking_service import BookingError, BookingService
+from tests.conftest import future
+
+UTC = timezone.utc
+# 2030-01-07 is a Monday
+MON = datetime(2030, 1, 7, 8, tzinfo=UTC)
+WEEKDAYS = 0b0011111
+
+
+def rule(start=MON, days=14, hours=10, mask=WEEKDAYS, plate="R1"):
+    return Rule(start, start + timedelta(days=days), plate, timedelta(hours=hours), mask)
+
+
+def test_occurrences_follow_weekday_mask():
+    occ = list(occurrences(rule()))
+    assert len(occ) == 10
+    assert all(s.weekday() < 5 for s, _ in occ)
+    assert occ[0] == (MON, MON + timedelta(hours=10))
+    assert occ[-1][0] == MON + timedelta(days=11)
+
+
+def test_occurrences_lie_wholly_inside_the_rule():
+    # Ends mid-occurrence on the second Monday: that occurrence is dropped
+    r = Rule(MON, MON + timedelta(days=7, hours=5), "R1", timedelta(hours=10), 1)
+    assert list(occurrences(r)) == [(MON, MON + timedelta(hours=10))]
+
+
+def test_occurrences_clipped_to_query_window():
+    lo, hi = MON + timedelta(days=2, hours=5), MON + timedelta(days=4)
+    starts = [s for s, _ in occurrences(rule(), lo, hi)]
+    # Wednesday is still in progress at lo; Friday starts at hi
+    assert starts == [MON + timedelta(days=2), MON + timedelta(days=3)]
+
+
+def test_occurrence_at():
+    r = rule()
+    assert occurrence_at(r, MON + timedelta(hours=9)) == (MON, MON + timedelta(hours=10))
+    assert occurrence_at(r, MON + timedelta(hours=10)) is None
+    assert occurrence_at(r, MON + timedelta(days=5, hours=1)) is None  # Saturday
+
+
+def test_occurrence_crossing_midnight():
+    r = Rule(MON.replace(hour=22), MON + timedelta(days=3), "R1", timedelta(hours=4), 1)
+    assert occurrence_at(r, MON.replace(hour=22) + timedelta(hours=3)) is not None
+
+
+def test_enclosing_gap_sees_rule_occurrences():
+    idx = SlotIndex(1, 1)
+    idx.add((0, 0), rule())
+    # Tuesday 08:00-18:00 is taken; the night in between is free
+    assert idx.enclosing_gap((0, 0), MON + timedelta(days=1, hours=1),
+                             MON + timedelta(days=1, hours=2)) is None
+    night = idx.enclosing_gap((0, 0), MON + timedelta(hours=12), MON + timedelta(hours=20))
+    assert night == (MON + timedelta(hours=10), MON + timedelta(days=1))
+    # A booking on the weekend is bounded by Friday's and Monday's occurrences
+    sat = MON + timedelta(days=5)
+    assert idx.enclosing_gap((0, 0), sat, sat + timedelta(hours=5)) == (
+        MON + timedelta(days=4, hours=10), MON + timedelta(days=7))
+
+
+def test_rule_fits_against_bookings_and_rules():
+    idx = SlotIndex(1, 1)
+    # Saturday booking: no overlap with a weekday rule
+    sat = MON + timedelta(days=5)
+    idx.add((0, 0), Booking(sat, sat + timedelta(hours=3), "A"))
+    assert idx.rule_fits((0, 0), rule())
+    # Booking on the second Wednesday hits one occurrence
+    wed = MON + timedelta(days=9, hours=9)
+    idx.add((0, 0), Booking(wed, wed + timedelta(hours=1), "B"))
+    assert not idx.rule_fits((0, 0), rule())
+    # Evening rule interleaves with the day rule; a morning one does not
+    idx2 = SlotIndex(1, 1)
+    idx2.add((0, 0), rule())
+    assert idx2.rule_fits((0, 0), rule(start=MON.replace(hour=19), hours=4))
+    assert not idx2.rule_fits((0, 0), rule(start=MON.replace(hour=6), hours=3))
+
+
+def test_choose_rule_slot_prefers_slots_with_rules():
+    idx = SlotIndex(1, 2)
+    idx.add((0, 1), rule(hours=4))
+    assert choose_rule_slot(idx, rule(start=MON.replace(hour=14), hours=4)) == (0, 1)
+
+
+def test_rule_after_cancelled_booking_with_same_window(service):
+    # The cancelled booking's expiry entry ties with the rule's on end,
+    # slot and plate; the heap must not go on to compare the two
+    start = future(3)
+    slot, s, e, _ = service.book(start, 10, 0, 0, "SAME1", owner="a@x.io")
+    service.cancel(*slot, s, e, "SAME1", "a@x.io")
+    slot, rule, _ = service.book_recurring(start, 10, [start.weekday()], start + timedelta(days=1),
+                                           "SAME1", owner="a@x.io")
+    assert (rule.start, rule.end) == (s, e)
+    assert service.expire(e) == 1
+
+
+def test_failed_journal_write_leaves_nothing_behind(service, journal, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(journal, "log_booking", fail)
+    start = future(3)
+    with pytest.raises(OSError):
+        service.book_recurring(start, 2, [0, 1, 2, 3, 4], start + timedelta(days=14), "FAIL1")
+    with pytest.raises(OSError):
+        service.book(start, 2, 0, 0, "FAIL1")
+    assert service.bookings_for_plate("FAIL1") == []
+    assert service.schedules == {}
+    assert service.occupancy_at(start) == 0
+
+
+def test_rules_survive_journal_replay(service, journal):
+    start = future(3)
+    slot, rule, _ = service.book_recurring(start, 2, [0, 2, 4], start + timedelta(days=21), "REP1",
+                                           owner="a@x.io")
+    replayed = BookingService(2, 2, journal)
+    [(key, found)] = replayed.bookings_for_plate("REP1")
+    assert key == slot
+    assert isinstance(found, Rule) and found == rule
+
+
+def test_local_schedule_keeps_wall_clock_across_dst():
+    berlin = ZoneInfo("Europe/Berlin")
+    # Clocks go forward on Sunday 2030-03-31
+    start = datetime(2030, 3, 25, 8, tzinfo=berlin)
+    r = Rule(start, start + timedelta(days=12), "TZ1", timedelta(hours=10), 0b0011111,
+             tz="Europe/Berlin")
+    local = [(s.astimezone(berlin), e.astimezone(berlin)) for s, e in occurrences(r)]
+    assert len(local) == 10
+    assert {(s.hour, e.hour) for s, e in local} == {(8, 18)}
+    assert next(occurrences(r))[0] == datetime(2030, 3, 25, 7, tzinfo=timezone.utc)
+    assert local[5][0] == datetime(2030, 4, 1, 8, tzinfo=berlin)
+    assert local[5][0].utcoffset() == timedelta(hours=2)
+    # The same rule in UTC drifts to 09:00-19:00 local after the change
+    utc = list(occurrences(r._replace(tz="UTC")))
+    assert utc[5][0].astimezone(berlin).hour == 9
+
+
+def test_time_zone_is_journaled(service, journal):
+    start = future(3).astimezone(ZoneInfo("America/New_York")).replace(hour=8)
+    slot, rule, _ = service.book_recurring(start, 10, [0, 1, 2, 3, 4], start + timedelta(days=200),
+                                           "TZ2", tz="America/New_York")
+    assert rule.tz == "America/New_York"
+    [(_, replayed)] = BookingService(2, 2, journal).bookings_for_plate("TZ2")
+    assert replayed == rule
+    assert all(s.astimezone(ZoneInfo("America/New_York")).hour == 8 for s, _ in occurrences(replayed))
+
+
+def test_unknown_time_zone(service):
+    with pytest.raises(BookingError, match="time zone"):
+        service.book_recurring(future(3), 2, [0], future(10), "TZ3", tz="Mars/Olympus")
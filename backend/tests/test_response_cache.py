@@ -0,0 +1,29 @@
+# tests/test_response_cache.py
+from datetime import datetime, timedelta, timezone
+
+from services.response_cache import ResponseCache
+
+AT = datetime(2030, 1, 7, 8, 0, 30, tzinfo=timezone.utc)
+
+
+def test_etag_is_stable_across_workers():
+    # Workers reading the same shared state must agree on the tag
+    a, b = ResponseCache(), ResponseCache()
+    key = a.key("occupancy", None, AT, 42)
+    assert key == b.key("occupancy", None, AT + timedelta(seconds=20), 42)
+    assert a.etag(key) == b.etag(key)
+    assert a.etag(key) != a.etag(a.key("occupancy", None, AT, 43))
+    assert a.not_modified(f'W/{a.etag(key)}, "x"', a.etag(key))
+    assert not a.not_modified(None, a.etag(key))
+
+
+def test_newer_version_drops_older_entries():
+    cache = ResponseCache(maxsize=2)
+    old = cache.key("occupancy", None, AT, 1)
+    cache.put(old, "old")
+    new = cache.key("occupancy", None, AT, 2)
+    cache.put(new, "new")
+    assert cache.get(old) is None and cache.get(new) == "new"
+    # Computed from a stale snapshot: not stored
+    cache.put(old, "stale")
+    assert cache.get(old) is None
@@ -0,0 +1,226 @@
+# tests/test_shared_state.py
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from multiprocessing import resource_tracker
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from services.allocator import Rule, SlotIndex
+from services.booking_service import BookingView
+from services.shared_state import (
+    _SEQ, _VERSION, SharedOccupancyReader, SharedOccupancyWriter, SharedStateUnavailable,
+)
+from tests.conftest import future
+
+
+@pytest.fixture
+def shm_name():
+    return f"pnr_test_{uuid.uuid4().hex[:12]}"
+
+
+def close(writer: SharedOccupancyWriter) -> None:
+    # A reader in the same process dropped the tracker's record of the
+    # segment; restore it so the writer's unlink is tracked cleanly
+    resource_tracker.register(writer._shm._name, "shared_memory")
+    writer.close()
+
+
+def test_round_trip(service, shm_name):
+    start = future()
+    service.book(start, 2, 0, 0, "A")
+    service.book(start + timedelta(hours=1), 2, 0, 0, "B")
+    service.book_recurring(start, 1, [0, 1, 2, 3, 4, 5, 6], start + timedelta(days=3), "R")
+    service.book_recurring(start + timedelta(hours=4), 2, [0, 2, 4], start + timedelta(days=9), "L",
+                           tz="Australia/Sydney")
+    writer = SharedOccupancyWriter(2, 2, shm_name)
+    try:
+        writer.publish(service.snapshot())
+        reader = SharedOccupancyReader(shm_name)
+        held = 0
+        times = [start + timedelta(hours=h) for h in range(0, 24 * 10, 1)]
+        for at in [start + timedelta(minutes=90), start + timedelta(days=1, minutes=30)] + times:
+            assert reader.occupancy_at(at) == service.occupancy_at(at), at
+            for r in range(2):
+                for c in range(2):
+                    slot = f"SLOT-{r:02d}{c:02d}"
+                    assert reader.is_slot_occupied(slot, at) == service.is_slot_occupied(slot, at)
+                    held += service.is_slot_occupied(slot, at)
+        assert held > 10
+        assert reader.version == service.version
+        assert reader.TOTAL == 4
+        assert not reader.is_slot_occupied("SLOT-0909", start)
+    finally:
+        close(writer)
+
+
+def test_rules_are_published_as_rules(shm_name):
+    # 120 weekday schedules over 1900 days: about 163,000 occurrences, but
+    # only 120 records in the segment
+    berlin = ZoneInfo("Europe/Berlin")
+    start = datetime(2030, 1, 7, 8, tzinfo=berlin)  # a Monday
+    res = SlotIndex(11, 11)
+    for k, key in zip(range(120), res.keys()):
+        res.add(key, Rule(start, start + timedelta(days=1900), f"R{k}", timedelta(hours=10),
+                          0b0011111, tz="Europe/Berlin"))
+    writer = SharedOccupancyWriter(11, 11, shm_name, capacity=10, rule_capacity=120)
+    try:
+        writer.publish(BookingView(res, {}, None, version=7))
+        reader = SharedOccupancyReader(shm_name)
+        # Summer time: still 08:00-18:00 local
+        assert reader.occupancy_at(datetime(2030, 7, 1, 17, 30, tzinfo=berlin)) == 120
+        assert reader.occupancy_at(datetime(2030, 7, 1, 18, 30, tzinfo=berlin)) == 0
+        assert reader.occupancy_at(datetime(2030, 7, 6, 12, tzinfo=berlin)) == 0  # Saturday
+        assert reader.is_slot_occupied("SLOT-0000", datetime(2030, 7, 1, 8, tzinfo=berlin))
+        assert not reader.is_slot_occupied("SLOT-1010", datetime(2030, 7, 1, 8, tzinfo=berlin))
+        assert reader.version == 7
+    finally:
+        close(writer)
+
+
+@pytest.mark.asyncio
+async def test_scheduled_publishes_are_coalesced(service, shm_name, monkeypatch):
+    writer = SharedOccupancyWriter(2, 2, shm_name, publish_interval=0.2)
+    builds = []
+    build = writer._build
+    monkeypatch.setattr(writer, "_build", lambda view: builds.append(view.version) or build(view))
+    try:
+        start = future()
+        for plate in "ABCD":
+            service.book(start, 1, 0, 0, plate)
+            writer.schedule(service.snapshot())
+        await writer._task
+        reader = SharedOccupancyReader(shm_name)
+        assert reader.occupancy_at(start) == 4
+        assert reader.version == service.version
+        # Four writer batches in one loop turn: only the last is built
+        assert builds == [service.version]
+
+        # The next one waits out the interval since the last publish
+        service.book(start + timedelta(hours=1), 1, 0, 0, "E")
+        writer.schedule(service.snapshot())
+        await asyncio.sleep(0)
+        assert reader.version != service.version
+        await writer._task
+        assert reader.version == service.version
+    finally:
+        close(writer)
+
+
+def test_capacity_exceeded_is_reported(service, shm_name):
+    start = future()
+    service.book(start, 1, 0, 0, "A")
+    service.book(start, 1, 0, 0, "B")
+    writer = SharedOccupancyWriter(2, 2, shm_name, capacity=1)
+    try:
+        writer.publish(service.snapshot())
+        with pytest.raises(SharedStateUnavailable):
+            SharedOccupancyReader(shm_name).occupancy_at(start)
+    finally:
+        close(writer)
+
+
+def test_reader_before_writer(shm_name):
+    with pytest.raises(SharedStateUnavailable):
+        SharedOccupancyReader(shm_name).occupancy_at(future())
+
+
+def _restart(old: SharedOccupancyWriter, svc, name: str, clean: bool) -> SharedOccupancyWriter:
+    resource_tracker.register(old._shm._name, "shared_memory")
+    if clean:
+        old.close()
+    else:
+        # The old writer "crashed": its mapping is gone but the segment
+        # is left for the new writer to find
+        old._buf.release()
+        old._shm.close()
+    writer = SharedOccupancyWriter(2, 2, name)
+    writer.publish(svc.snapshot())
+    return writer
+
+
+@pytest.mark.parametrize("clean", [True, False])
+def test_reader_follows_writer_restart(service, shm_name, clean):
+    start = future()
+    writer = SharedOccupancyWriter(2, 2, shm_name)
+    writer.publish(service.snapshot())
+    reader = SharedOccupancyReader(shm_name, recheck=3600)
+    assert reader.occupancy_at(start) == 0
+    old_version = reader.version
+
+    service.book(start, 1, 0, 0, "A")
+    writer = _restart(writer, service, shm_name, clean)
+    try:
+        assert reader.occupancy_at(start) == 1
+        assert reader.version > old_version
+    finally:
+        close(writer)
+
+
+def test_reader_stops_when_writer_closes(service, shm_name):
+    writer = SharedOccupancyWriter(2, 2, shm_name)
+    writer.publish(service.snapshot())
+    reader = SharedOccupancyReader(shm_name, recheck=3600)
+    reader.occupancy_at(future())
+    close(writer)
+    with pytest.raises(SharedStateUnavailable):
+        reader.occupancy_at(future())
+
+
+def test_reader_rechecks_the_published_segment(service, shm_name):
+    start = future()
+    writer = SharedOccupancyWriter(2, 2, shm_name)
+    writer.publish(service.snapshot())
+    reader = SharedOccupancyReader(shm_name, recheck=0)
+    reader.occupancy_at(start)
+    # A writer whose predecessor vanished without retiring its segment
+    resource_tracker.register(writer._shm._name, "shared_memory")
+    writer._buf.release()
+    writer._shm.close()
+    writer._shm.unlink()
+    service.book(start, 1, 0, 0, "A")
+    writer = SharedOccupancyWriter(2, 2, shm_name)
+    writer.publish(service.snapshot())
+    try:
+        assert reader.occupancy_at(start) == 1
+    finally:
+        close(writer)
+
+
+def test_reader_retries_a_read_torn_by_a_publish(service, shm_name):
+    start = future()
+    writer = SharedOccupancyWriter(2, 2, shm_name)
+    try:
+        writer.publish(service.snapshot())
+        reader = SharedOccupancyReader(shm_name)
+        seen = []
+
+        def read(buf):
+            seen.append(buf[_VERSION])
+            if len(seen) == 1:
+                # The writer publishes while this read is in progress
+                service.book(start, 1, 0, 0, "TORN")
+                writer.publish(service.snapshot())
+            return buf[_VERSION]
+
+        assert reader._read(read) == service.version
+        assert seen == [service.version - 1, service.version]
+        assert reader.occupancy_at(start) == 1
+    finally:
+        close(writer)
+
+
+def test_reader_gives_up_on_a_write_that_never_finishes(service, shm_name, monkeypatch):
+    writer = SharedOccupancyWriter(2, 2, shm_name)
+    try:
+        writer.publish(service.snapshot())
+        reader = SharedOccupancyReader(shm_name, recheck=3600)
+        monkeypatch.setattr(reader, "MAX_RETRIES", 5)
+        writer._buf[_SEQ] += 1  # a writer stopped mid-publish
+        with pytest.raises(SharedStateUnavailable, match="busy"):
+            reader.occupancy_at(future())
+        writer._buf[_SEQ] += 1
+        assert reader.occupancy_at(future()) == 0
+    finally:
+        close(writer)
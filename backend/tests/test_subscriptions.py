@@ -0,0 +1,50 @@
+# tests/test_subscriptions.py
+import json
+
+import pytest
+import stripe
+
+from tests.conftest import auth
+from utils.fake_stripe import FakeStripe
+from utils.mongo import get_db
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    fake = FakeStripe(latency=0, jitter=0)
+    monkeypatch.setattr(stripe.checkout.Session, "create", fake.create_session)
+    monkeypatch.setattr(stripe.Webhook, "construct_event", fake.construct_event)
+    return fake
+
+
+async def _deliver(api, event):
+    resp = await api.post("/subscriptions/webhook", content=json.dumps(event),
+                          headers={"Stripe-Signature": "t=0,v1=fake"})
+    assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_checkout_records_the_subscribing_user(api, fake_stripe):
+    resp = await api.post("/subscriptions/create-checkout-session", json={"plate": "sub1"},
+                          headers=auth("buyer@x.io"))
+    assert resp.status_code == 200
+    await _deliver(api, fake_stripe.completed_event(resp.json()["sessionId"]))
+    doc = await get_db()["subscribers"].find_one({"plate": "SUB1"})
+    assert doc["user"] == "buyer@x.io"
+
+
+@pytest.mark.asyncio
+async def test_checkout_requires_sign_in(api, fake_stripe):
+    resp = await api.post("/subscriptions/create-checkout-session", json={"plate": "SUB2"})
+    assert resp.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_session_without_user_is_still_recorded(api, fake_stripe):
+    # Sessions opened before checkout recorded the buyer carry only the plate
+    event = {"type": "checkout.session.completed", "data": {"object": {
+        "id": "cs_legacy", "created": 1700000000, "metadata": {"plate": "SUB3"}}}}
+    await _deliver(api, event)
+    doc = await get_db()["subscribers"].find_one({"plate": "SUB3"})
+    assert doc["stripeSessionId"] == "cs_legacy"
+    assert "user" not in doc
@@ -0,0 +1,214 @@
+# tests/test_waitlist.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.booking_service import BookingError, BookingService
+from services.notifications import callback_allowed
+from services.waitlist import Waitlist
+from tests.conftest import auth, future
+
+T0 = datetime(2030, 1, 7, 8, tzinfo=timezone.utc)
+H = timedelta(hours=1)
+
+
+def test_subscribers_first_then_arrival_order():
+    wl = Waitlist()
+    a = wl.add(T0, T0 + 2 * H, "A", "a")
+    b = wl.add(T0, T0 + 2 * H, "B", "b")
+    s = wl.add(T0, T0 + 2 * H, "S", "s", subscriber=True)
+    assert [e.plate for e in wl.candidates(T0, T0 + 2 * H)] == ["S", "A", "B"]
+    assert [wl.position(e.entry_id) for e in (s, a, b)] == [1, 2, 3]
+
+
+def test_candidates_span_overlapping_windows_only():
+    wl = Waitlist()
+    wl.add(T0 - 2 * H, T0, "BEFORE", "u")       # ends where the freed window starts
+    early = wl.add(T0 - H, T0 + H, "EARLY", "u")
+    late = wl.add(T0 + H, T0 + 3 * H, "LATE", "u", subscriber=True)
+    wl.add(T0 + 3 * H, T0 + 4 * H, "AFTER", "u")
+    found = list(wl.candidates(T0, T0 + 3 * H))
+    # Best first across windows: the subscriber beats an earlier arrival
+    assert found == [late, early]
+
+
+def test_remove_updates_positions():
+    wl = Waitlist()
+    a = wl.add(T0, T0 + H, "A", "a")
+    b = wl.add(T0, T0 + H, "B", "b")
+    assert wl.remove(a.entry_id) == a
+    assert wl.remove(a.entry_id) is None
+    assert wl.position(b.entry_id) == 1
+    assert wl.position(a.entry_id) is None
+    wl.remove(b.entry_id)
+    assert len(wl) == 0
+    assert list(wl.candidates(T0, T0 + H)) == []
+
+
+def test_removal_while_iterating_candidates():
+    wl = Waitlist()
+    a = wl.add(T0, T0 + H, "A", "a")
+    b = wl.add(T0, T0 + H, "B", "b")
+    seen = []
+    for entry in wl.candidates(T0, T0 + H):
+        seen.append(entry)
+        wl.remove(b.entry_id)
+    assert seen == [a]
+
+
+def test_expire_drops_started_windows():
+    wl = Waitlist()
+    started = wl.add(T0, T0 + H, "A", "a")
+    at_now = wl.add(T0 + H, T0 + 2 * H, "B", "b")
+    later = wl.add(T0 + 2 * H, T0 + 3 * H, "C", "c")
+    dropped = wl.expire(T0 + H)
+    assert set(dropped) == {started, at_now}
+    assert wl.get(later.entry_id) == later
+    assert wl.position(later.entry_id) == 1
+    assert list(wl.candidates(T0, T0 + 3 * H)) == [later]
+
+
+def test_for_user():
+    wl = Waitlist()
+    a = wl.add(T0, T0 + H, "A", "a")
+    wl.add(T0, T0 + H, "B", "b")
+    assert wl.for_user("a") == [a]
+
+
+def test_callbacks_denied_unless_host_allowlisted():
+    hosts = {"hooks.example.com"}
+    assert callback_allowed("https://hooks.example.com/park", hosts)
+    assert not callback_allowed("https://hooks.example.com/park", frozenset())
+    assert not callback_allowed("http://169.254.169.254/latest/meta-data", hosts)
+    assert not callback_allowed("http://localhost:8000/", hosts)
+    assert not callback_allowed("ftp://hooks.example.com/", hosts)
+    assert not callback_allowed("http://[::1/", hosts)
+
+
+@pytest.mark.asyncio
+async def test_join_refuses_callback_when_none_allowed(api):
+    resp = await api.post("/waitlist", json={"start": future(3).isoformat(), "hours": 1, "plate": "CB1",
+                                             "callback_url": "http://169.254.169.254/latest"},
+                          headers=auth("cb@x.io"))
+    assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_subscriber_priority_belongs_to_the_subscribing_account(api):
+    from main import get_shard
+    from utils.mongo import get_db
+
+    shard = get_shard(None)
+    start = future(40)
+    for i in range(shard.config.rows * shard.config.cols):
+        shard.service.book(start, 1, 0, 0, f"FULL{i}", owner="filler@x.io")
+    await get_db()["subscribers"].insert_one({"plate": "SUBW1", "user": "owner@x.io"})
+
+    body = {"start": start.isoformat(), "hours": 1}
+    thief = await api.post("/waitlist", json={**body, "plate": "SUBW1"}, headers=auth("thief@x.io"))
+    owner = await api.post("/waitlist", json={**body, "plate": "SUBW1"}, headers=auth("owner@x.io"))
+    assert thief.json()["status"] == owner.json()["status"] == "waiting"
+    assert owner.json()["entry"]["position"] == 1
+
+    mine = await api.get("/waitlist", headers=auth("thief@x.io"))
+    assert [e["position"] for e in mine.json()["entries"]] == [2]
+
+
+def _fill(service, start, hours=4):
+    return [service.book(start, hours, 0, 0, f"FULL{i}", owner="filler@x.io")[0] for i in range(4)]
+
+
+def test_cancel_offers_only_the_freed_slot(service, monkeypatch):
+    start = future(3)
+    slots = _fill(service, start)
+    waiting = [service.join_waitlist(start, 1, 0, 0, f"W{i}", f"w{i}@x.io")[1] for i in range(50)]
+    # Matching must not run the allocator over the whole lot per waiter
+    monkeypatch.setattr(service, "find_slot", lambda *a: pytest.fail("allocator pass"))
+    service.cancel(*slots[2], start, start + 4 * H, "FULL2", "filler@x.io")
+    [(entry, result)] = service.drain_allocations()
+    assert entry == waiting[0]
+    assert result[0] == slots[2]
+    assert len(service.waitlist) == 49
+
+
+def test_freed_interval_is_shared_until_used_up(service):
+    start = future(3)
+    slots = _fill(service, start)
+    a = service.join_waitlist(start, 2, 0, 0, "A", "a@x.io")[1]
+    c = service.join_waitlist(start + H, 2, 0, 0, "C", "c@x.io")[1]
+    b = service.join_waitlist(start + 2 * H, 2, 0, 0, "B", "b@x.io")[1]
+    later = service.join_waitlist(start + 4 * H, 1, 0, 0, "L", "l@x.io")
+    assert later[0] == "booked"  # after the fillers end: no need to wait
+    service.cancel(*slots[0], start, start + 4 * H, "FULL0", "filler@x.io")
+    # C overlaps A's allocation; B fits the rest of the freed window
+    assert [e for e, _ in service.drain_allocations()] == [a, b]
+    assert service.waitlist.get(c.entry_id) == c
+
+
+def test_waitlist_entries_are_capped_per_user(service, monkeypatch):
+    monkeypatch.setattr(BookingService, "WAITLIST_MAX_PER_USER", 2)
+    start = future(3)
+    _fill(service, start)
+    for i in range(2):
+        assert service.join_waitlist(start, 1, 0, 0, "CAP1", "cap@x.io")[0] == "waiting"
+    with pytest.raises(BookingError, match="At most 2"):
+        service.join_waitlist(start, 1, 0, 0, "CAP1", "cap@x.io")
+    # Someone else still can, and leaving frees a place
+    assert service.join_waitlist(start, 1, 0, 0, "CAP2", "other@x.io")[0] == "waiting"
+    service.leave_waitlist(service.waitlist.for_user("cap@x.io")[0].entry_id, "cap@x.io")
+    assert service.join_waitlist(start, 1, 0, 0, "CAP1", "cap@x.io")[0] == "waiting"
+
+
+@pytest.mark.asyncio
+async def test_engine_cancel_allocates_the_waiter_and_announces_it(service):
+    from services.booking_engine import BookingEngine
+
+    engine = BookingEngine(service)
+    announced = []
+    engine.subscribe_allocations(lambda entry, result: announced.append(
+        (entry, result, engine.snapshot.bookings_for_plate(entry.plate))))
+    start = future(3)
+    booked = [await engine.book(start, 2, 0, 0, f"FULL{i}", "filler@x.io") for i in range(4)]
+    status, entry, position = await engine.join_waitlist(start, 1, 0, 0, "WAIT1", "w@x.io")
+    assert (status, position) == ("waiting", 1)
+    try:
+        slot, s, e, _ = booked[1]
+        await engine.cancel(*slot, s, e, "FULL1", "filler@x.io")
+    finally:
+        await engine.stop()
+    [(got, result, visible)] = announced
+    assert got == entry
+    assert result[:3] == (slot, start, start + H)
+    # Announced after the snapshot that holds the new booking
+    assert [kb[0] for kb in visible] == [slot]
+    assert len(service.waitlist) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel_through_the_app_notifies_the_waiter(api):
+    from main import get_shard
+    from services.notifications import notifier
+
+    shard = get_shard(None)
+    start = future(45, hour=3)
+    for i in range(shard.config.rows * shard.config.cols):
+        await shard.engine.book(start, 2, 0, 0, f"NFULL{i}", "filler@x.io")
+    resp = await api.post("/waitlist", json={"start": start.isoformat(), "hours": 1, "plate": "NWAIT1"},
+                          headers=auth("notify@x.io"))
+    assert resp.json()["status"] == "waiting"
+    entry_id = resp.json()["entry"]["entry_id"]
+
+    queue = notifier.listen("notify@x.io")
+    try:
+        [freed] = (await api.get("/bookings", params={"plate": "NFULL0"},
+                                 headers=auth("filler@x.io"))).json()["bookings"]
+        resp = await api.delete(f"/bookings/{freed['booking_id']}", headers=auth("filler@x.io"))
+        assert resp.status_code == 200
+        event = queue.get_nowait()
+    finally:
+        notifier.unlisten("notify@x.io", queue)
+    assert event["entry_id"] == entry_id
+    assert event["slot"] == freed["slot"] and event["plate"] == "NWAIT1"
+    [mine] = (await api.get("/bookings", params={"plate": "NWAIT1"},
+                            headers=auth("notify@x.io"))).json()["bookings"]
+    assert mine["booking_id"] == event["booking_id"]
@@ -0,0 +1,108 @@
+# utils/allocation_sim.py
+"""
+Replay a synthetic demand trace against each slot allocation strategy and
+report acceptance, utilization and allocation latency.
+
+    python -m utils.allocation_sim --requests 12000 --seed 7
+"""
+import argparse
+import heapq
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from services.allocator import Booking, SlotIndex, make_strategy
+
+ROWS, COLS = 20, 20
+HORIZON = timedelta(days=90)
+
+# (class name, weight, min duration, max duration, max lead time)
+DEMAND_MIX = [
+    ("hourly",  0.60, timedelta(hours=1), timedelta(hours=10), timedelta(days=7)),
+    ("daily",   0.25, timedelta(days=1),  timedelta(days=3),   timedelta(days=14)),
+    ("weekly",  0.10, timedelta(days=7),  timedelta(days=14),  timedelta(days=21)),
+    ("monthly", 0.05, timedelta(days=30), timedelta(days=31),  timedelta(days=30)),
+]
+
+
+def demand_trace(n: int, seed: int, base: datetime) -> List[Tuple[datetime, str, datetime, datetime]]:
+    """Return (requested_at, class, start, end) tuples in arrival order."""
+    rng = random.Random(seed)
+    weights = [w for _, w, *_ in DEMAND_MIX]
+    trace = []
+    for _ in range(n):
+        name, _, lo, hi, lead = rng.choices(DEMAND_MIX, weights)[0]
+        hours = HORIZON.total_seconds() / 3600
+        start = base + timedelta(hours=rng.randrange(int(hours)))
+        length = lo + timedelta(hours=rng.randrange(int((hi - lo).total_seconds() // 3600) + 1))
+        requested_at = start - timedelta(hours=rng.randrange(int(lead.total_seconds() // 3600) + 1))
+        trace.append((requested_at, name, start, start + length))
+    trace.sort(key=lambda t: t[0])
+    return trace
+
+
+def _pct(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(p * len(sorted_vals)))]
+
+
+def simulate(strategy_name: str, trace, base: datetime) -> Dict:
+    index = SlotIndex(ROWS, COLS)
+    strategy = make_strategy(strategy_name, ROWS, COLS)
+    expiry: List[Tuple[datetime, Tuple[int, int], Booking]] = []
+    accepted: Dict[str, int] = {}
+    offered: Dict[str, int] = {}
+    latencies: List[float] = []
+    busy = timedelta(0)
+
+    for requested_at, name, start, end in trace:
+        # Archive finished bookings, as BookingService.expire does
+        while expiry and expiry[0][0] <= requested_at:
+            _, key, b = heapq.heappop(expiry)
+            index.remove(key, b)
+
+        offered[name] = offered.get(name, 0) + 1
+        t0 = time.perf_counter()
+        slot = strategy.choose(index, start, end)
+        latencies.append((time.perf_counter() - t0) * 1e6)
+        if slot is None:
+            continue
+
+        b = Booking(start=start, end=end, plate=name)
+        index.add(slot, b)
+        heapq.heappush(expiry, (end, slot, b))
+        accepted[name] = accepted.get(name, 0) + 1
+        busy += min(end, base + HORIZON) - start
+
+    latencies.sort()
+    capacity = HORIZON * ROWS * COLS
+    return {
+        "strategy": strategy_name,
+        "accepted": {k: (accepted.get(k, 0), offered[k]) for k in offered},
+        "utilization": busy / capacity,
+        "p50_us": _pct(latencies, 0.50),
+        "p95_us": _pct(latencies, 0.95),
+        "p99_us": _pct(latencies, 0.99),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=12000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--strategies", default="first-fit,best-fit,zone")
+    args = parser.parse_args()
+
+    base = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    trace = demand_trace(args.requests, args.seed, base)
+    for name in args.strategies.split(","):
+        r = simulate(name, trace, base)
+        classes = "  ".join(f"{k} {a}/{o}" for k, (a, o) in sorted(r["accepted"].items()))
+        print(f"{r['strategy']:>9}  util {r['utilization']:.1%}  "
+              f"p50 {r['p50_us']:.0f}us  p95 {r['p95_us']:.0f}us  p99 {r['p99_us']:.0f}us  {classes}")
+
+
+if __name__ == "__main__":
+    main()
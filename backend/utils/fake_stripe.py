@@ -0,0 +1,74 @@
+# utils/fake_stripe.py
+"""
+Offline stand-in for the Stripe calls made by routes/payments.py and
+routes/subscriptions.py. install() patches the stripe module in place, so
+route code runs unchanged; every call sleeps for a configurable latency
+to mimic the network round trip (blocking, like the real client).
+"""
+import json
+import random
+import time
+import uuid
+from types import SimpleNamespace
+
+import stripe
+
+
+class FakeStripe:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._intents = {}
+        self._sessions = {}
+        self.calls = 0
+
+    def _wait(self) -> None:
+        self.calls += 1
+        delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def create_intent(self, amount, currency="usd", metadata=None, **kwargs):
+        self._wait()
+        pi_id = f"pi_{uuid.uuid4().hex[:24]}"
+        intent = SimpleNamespace(
+            id=pi_id, amount=amount, currency=currency, metadata=metadata or {},
+            client_secret=f"{pi_id}_secret_{uuid.uuid4().hex[:16]}",
+            status="succeeded", created=int(time.time()),
+        )
+        self._intents[pi_id] = intent
+        return intent
+
+    def retrieve_intent(self, intent_id, **kwargs):
+        self._wait()
+        intent = self._intents.get(intent_id)
+        if intent is None:
+            raise stripe.error.InvalidRequestError(f"No such payment_intent: {intent_id}", "id")
+        return intent
+
+    def create_session(self, **kwargs):
+        self._wait()
+        session = SimpleNamespace(id=f"cs_{uuid.uuid4().hex[:24]}", created=int(time.time()), **kwargs)
+        self._sessions[session.id] = session
+        return session
+
+    def completed_event(self, session_id: str) -> dict:
+        """The checkout.session.completed event Stripe would send for a session."""
+        session = self._sessions[session_id]
+        return {"type": "checkout.session.completed", "data": {"object": {
+            "id": session.id, "created": session.created,
+            "metadata": dict(session.metadata or {}),
+        }}}
+
+    @staticmethod
+    def construct_event(payload, sig_header, secret, **kwargs):
+        # No signature check: the load generator posts events directly
+        return json.loads(payload)
+
+    def install(self) -> "FakeStripe":
+        stripe.PaymentIntent.create = self.create_intent
+        stripe.PaymentIntent.retrieve = self.retrieve_intent
+        stripe.checkout.Session.create = self.create_session
+        stripe.Webhook.construct_event = self.construct_event
+        return self
@@ -0,0 +1,185 @@
+# utils/loadtest.py
+"""
+In-process load generator: drives the FastAPI app through user journeys
+against an in-memory Mongo stand-in and a fake Stripe, then reports
+throughput and p50/p95/p99 latency per route.
+
+    python -m utils.loadtest --users 50 --journeys 20 --stripe-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+MAX_RETRIES = 30
+
+
+def _configure_env() -> None:
+    # Must run before the app is imported: mongo and the journal read these
+    os.environ["MONGO_URI"] = "memory://"
+    os.environ.setdefault("BOOKING_LOG_FILE",
+                          os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "realtime.log"))
+    os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_loadtest")
+    # Every simulated user shares one client IP; keep per-IP buckets out of
+    # the way unless asked for. Concurrency caps still apply.
+    os.environ.setdefault("ADMISSION_BACKEND", "off")
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, route: str, seconds: float, status: int) -> None:
+        self.latencies[route].append(seconds)
+        if status >= 400:
+            self.errors[route] += 1
+
+    def report(self, elapsed: float) -> str:
+        lines = [f"{'route':<46}{'count':>7}{'err':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+        total = 0
+        for route in sorted(self.latencies):
+            lat = sorted(self.latencies[route])
+            total += len(lat)
+            pct = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000
+            lines.append(f"{route:<46}{len(lat):>7}{self.errors[route]:>6}"
+                         f"{len(lat) / elapsed:>9.1f}{pct(0.50):>9.1f}{pct(0.95):>9.1f}{pct(0.99):>9.1f}")
+        lines.append(f"{total} requests in {elapsed:.2f}s ({total / elapsed:.1f} req/s)")
+        return "\n".join(lines)
+
+
+async def user_session(client, stats: Stats, uid: int, journeys: int, seed: int,
+                       cancel_ratio: float, subscribe_ratio: float, polls: int,
+                       retry_ratio: float = 0.0, stripe=None) -> None:
+    rng = random.Random(seed * 100003 + uid)
+
+    async def call(route: str, method: str, url: str, **kwargs):
+        # Behave like a well-mannered client: honour 429 Retry-After
+        for _ in range(MAX_RETRIES):
+            t0 = time.perf_counter()
+            resp = await client.request(method, url, **kwargs)
+            stats.record(route, time.perf_counter() - t0, resp.status_code)
+            if resp.status_code != 429:
+                break
+            await asyncio.sleep(float(resp.headers.get("retry-after", 1)))
+        return resp
+
+    email = f"user{uid}@loadtest.local"
+    await call("POST /auth/register", "POST", "/auth/register",
+               json={"email": email, "password": "password123"})
+    resp = await call("POST /auth/login", "POST", "/auth/login",
+                      json={"email": email, "password": "password123"})
+    headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+    for _ in range(journeys):
+        start = (datetime.now(timezone.utc) + timedelta(hours=rng.randint(1, 24 * 30))
+                 ).replace(minute=0, second=0, microsecond=0)
+        hours = rng.choice([1, 2, 3, 4, 8])
+        plate = f"LT{uid:04d}"
+        at = {"at": start.isoformat()}
+
+        # Quote: the cost page loads profile, subscribers and occupancy
+        await call("GET /auth/me", "GET", "/auth/me", headers=headers)
+        resp = await call("GET /subscribers/", "GET", "/subscribers/", headers=headers)
+        subscribed = resp.status_code == 200 and plate in resp.json()
+        await call("GET /occupancy", "GET", "/occupancy", params=at, headers=headers)
+
+        # Mobile clients send an Idempotency-Key and retry on timeouts
+        key = {"Idempotency-Key": f"{uid}-{rng.getrandbits(64):x}"}
+        intent_req = {"amount_cents": hours * 2000, "metadata": {"plate": plate}}
+        resp = await call("POST /payments/create-intent", "POST", "/payments/create-intent",
+                          json=intent_req, headers=key)
+        if rng.random() < retry_ratio:
+            resp = await call("POST /payments/create-intent (retry)", "POST",
+                              "/payments/create-intent", json=intent_req, headers=key)
+        intent_id = resp.json()["client_secret"].split("_secret_")[0] if resp.status_code == 200 else None
+
+        book_req = {"start": start.isoformat(), "hours": hours, "plate": plate}
+        resp = await call("POST /book", "POST", "/book", headers={**headers, **key}, json=book_req)
+        if rng.random() < retry_ratio:
+            resp = await call("POST /book (retry)", "POST", "/book",
+                              headers={**headers, **key}, json=book_req)
+        if resp.status_code != 200:
+            continue
+        booking = resp.json()
+
+        if intent_id:
+            await call("POST /payments/confirm", "POST", "/payments/confirm",
+                       json={"payment_intent_id": intent_id, "booking_id": booking["booking_id"]})
+
+        for _ in range(polls):
+            await call("GET /occupancy", "GET", "/occupancy", params=at, headers=headers)
+            await call("GET /free-slots", "GET", "/free-slots", params=at, headers=headers)
+
+        if rng.random() < cancel_ratio:
+            await call("DELETE /bookings/{booking_id}", "DELETE",
+                       f"/bookings/{booking['booking_id']}", headers=headers)
+
+        # The subscribe page only offers checkout to plates without a subscription
+        if not subscribed and rng.random() < subscribe_ratio:
+            resp = await call("POST /subscriptions/create-checkout-session", "POST",
+                              "/subscriptions/create-checkout-session", json={"plate": plate},
+                              headers=headers)
+            if resp.status_code == 200 and stripe is not None:
+                # Paid: Stripe reports the session back with its metadata
+                event = stripe.completed_event(resp.json()["sessionId"])
+                await call("POST /subscriptions/webhook", "POST", "/subscriptions/webhook",
+                           content=json.dumps(event), headers={"Stripe-Signature": "t=0,v1=fake"})
+
+
+async def run(args) -> Stats:
+    _configure_env()
+    import httpx
+    from utils.fake_stripe import FakeStripe
+    from utils.logger import logger, console_handler
+    from main import app
+    from services.lots import lots
+    from services.profiles import profiles
+
+    stripe = FakeStripe(latency=args.stripe_latency, jitter=args.stripe_latency / 4, seed=args.seed).install()
+    # Per-request console logging would dominate the timings
+    logger.removeHandler(console_handler)
+    logger.propagate = False
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    stats = Stats()
+    await profiles.start()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            user_session(client, stats, uid, args.journeys, args.seed,
+                         args.cancel_ratio, args.subscribe_ratio, args.polls, args.retry_ratio, stripe)
+            for uid in range(args.users)
+        ))
+        elapsed = time.perf_counter() - t0
+    await lots.stop()
+    await profiles.stop()
+    print(stats.report(elapsed))
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--journeys", type=int, default=20, help="booking journeys per user")
+    parser.add_argument("--polls", type=int, default=3, help="occupancy polls per journey")
+    parser.add_argument("--cancel-ratio", type=float, default=0.3)
+    parser.add_argument("--subscribe-ratio", type=float, default=0.1)
+    parser.add_argument("--retry-ratio", type=float, default=0.1,
+                        help="share of bookings and intents resent with the same Idempotency-Key")
+    parser.add_argument("--stripe-latency", type=float, default=0.05, help="seconds per Stripe call")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
 # utils/logger.py
 import os
 import logging
-from datetime import datetime
-from typing import List, Tuple, Dict
-from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
 
-Booking = namedtuple("Booking", ["start", "end", "plate"])
-LOG_FILE = os.path.join(os.path.dirname(__file__), "..", "realtime.log")
+from services.allocator import Booking, Rule
+
+LOG_FILE = os.getenv("BOOKING_LOG_FILE",
+                     os.path.join(os.path.dirname(__file__), "..", "realtime.log"))
 
 # Ensure log file exists
 os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
@@ -34,41 +36,136 @@ file_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 logger.addHandler(file_handler)
 
-def _append_event(fields: List[str]) -> None:
-    logger.info(" ".join(fields))
-
-def log_booking(r, c, plate, sy, smo, sd, sh, smin, ey, emo, ed, eh, emin):
-    _append_event(["BOOKING", str(r), str(c), plate,
-                   str(sy), str(smo), str(sd), str(sh), str(smin),
-                   str(ey), str(emo), str(ed), str(eh), str(emin)])
-
-def log_cancellation(r, c, plate, sy, smo, sd, sh, smin, ey, emo, ed, eh, emin):
-    _append_event(["CANCEL", str(r), str(c), plate,
-                   str(sy), str(smo), str(sd), str(sh), str(smin),
-                   str(ey), str(emo), str(ed), str(eh), str(emin)])
-
-def replay_reservations() -> Dict[Tuple[int, int], Booking]:
-    reservations = {}
-    with open(LOG_FILE, "r") as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) < 5:
-                continue
-            _, etype, rs, cs, plate, *rest = parts
-            if len(rest) != 10:
-                continue
-            try:
-                r, c = int(rs), int(cs)
-                times = list(map(int, rest))
-                sdt = datetime(*times[:5])
-                edt = datetime(*times[5:])
-                key = (r, c)
-                if etype == "BOOKING":
-                    reservations[key] = Booking(start=sdt, end=edt, plate=plate)
-                elif etype == "CANCEL":
-                    existing = reservations.get(key)
-                    if existing and existing.start == sdt and existing.end == edt and existing.plate == plate:
-                        reservations.pop(key, None)
-            except:
+class Journal:
+    """
+    Append-only booking journal backed by one log file. Each lot writes its
+    own journal; the module-level helpers below use the default one.
+    """
+
+    def __init__(self, path: str, log: Optional[logging.Logger] = None):
+        self.path = path
+        if log is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # Not a child of booking_logger, so lines never reach the default file
+            log = logging.getLogger(f"booking_journal.{os.path.abspath(path)}")
+            if not log.handlers:
+                log.setLevel(logging.INFO)
+                log.propagate = False
+                handler = logging.FileHandler(path)
+                handler.setLevel(logging.INFO)
+                handler.setFormatter(formatter)
+                log.addHandler(handler)
+        if not os.path.exists(path):
+            open(path, "a").close()
+        self.logger = log
+
+    def _append_event(self, fields: List[str]) -> None:
+        self.logger.info(" ".join(fields))
+
+    # Recurring rules pass *schedule = (duration minutes, weekday bitmask);
+    # readers that predate rules skip those lines by their field count.
+    # Owner, serial and a rule's time zone, if any, follow as
+    # owner=<url-quoted sub> serial=<n> tz=<IANA name>; a rule without tz
+    # repeats in UTC.
+    def log_booking(self, r, c, plate, sy, smo, sd, sh, smin, ey, emo, ed, eh, emin, *schedule,
+                    owner: str = "", serial: int = 0, tz: str = "UTC"):
+        self._append_event(["BOOKING", str(r), str(c), plate,
+                            str(sy), str(smo), str(sd), str(sh), str(smin),
+                            str(ey), str(emo), str(ed), str(eh), str(emin),
+                            *map(str, schedule), *self._tagged_fields(owner, serial, tz)])
+
+    def log_cancellation(self, r, c, plate, sy, smo, sd, sh, smin, ey, emo, ed, eh, emin, *schedule,
+                         owner: str = "", serial: int = 0, tz: str = "UTC"):
+        self._append_event(["CANCEL", str(r), str(c), plate,
+                            str(sy), str(smo), str(sd), str(sh), str(smin),
+                            str(ey), str(emo), str(ed), str(eh), str(emin),
+                            *map(str, schedule), *self._tagged_fields(owner, serial, tz)])
+
+    @staticmethod
+    def _tagged_fields(owner: str, serial: int, tz: str = "UTC") -> List[str]:
+        fields = []
+        if owner:
+            fields.append(f"owner={quote(owner, safe='@')}")
+        if serial:
+            fields.append(f"serial={serial}")
+        if tz != "UTC":
+            fields.append(f"tz={quote(tz, safe='/')}")
+        return fields
+
+    def _read_events(self) -> Iterator[Tuple[str, Tuple[int, int], Booking]]:
+        """Yield (event_type, (r, c), Booking or Rule) for every well-formed journal line."""
+        with open(self.path, "r") as f:
+            for line in f:
+                # Drop the "[YYYY-mm-dd HH:MM:SS] " prefix added by the formatter
+                parts = line.strip().split("] ", 1)[-1].split()
+                if len(parts) < 4:
+                    continue
+                etype, rs, cs, plate, *rest = parts
+                tags = {}
+                while rest and "=" in rest[-1]:
+                    name, _, value = rest.pop().partition("=")
+                    tags[name] = value
+                if len(rest) not in (10, 12):
+                    continue
+                owner = unquote(tags.get("owner", ""))
+                try:
+                    serial = int(tags.get("serial", 0))
+                    r, c = int(rs), int(cs)
+                    times = list(map(int, rest))
+                    sdt = datetime(*times[:5], tzinfo=timezone.utc)
+                    edt = datetime(*times[5:10], tzinfo=timezone.utc)
+                except:
+                    continue
+                if len(times) == 12:
+                    yield etype, (r, c), Rule(start=sdt, end=edt, plate=plate,
+                                              duration=timedelta(minutes=times[10]), weekdays=times[11],
+                                              owner=owner, serial=serial,
+                                              tz=unquote(tags.get("tz", "UTC")))
+                else:
+                    yield etype, (r, c), Booking(start=sdt, end=edt, plate=plate, owner=owner,
+                                                 serial=serial)
+
+    def replay_reservations(self, since: Optional[datetime] = None) -> List[Tuple[Tuple[int, int], Booking]]:
+        """
+        Rebuild live reservations from the journal as ((r, c), Booking) pairs.
+        Bookings that ended at or before `since` are left in the journal only
+        (see archived_reservations).
+        """
+        reservations = {}
+        for etype, key, b in self._read_events():
+            if etype == "BOOKING":
+                if since is not None and b.end <= since:
+                    continue
+                reservations[(key, b)] = None
+            elif etype == "CANCEL":
+                reservations.pop((key, b), None)
+        return list(reservations)
+
+    def cancelled_reservations(self, since: datetime) -> List[Tuple[Tuple[int, int], Booking]]:
+        """Cancelled bookings from the journal whose window ends after `since`."""
+        return [(key, b) for etype, key, b in self._read_events()
+                if etype == "CANCEL" and b.end > since]
+
+    def archived_reservations(self, before: datetime, plate: Optional[str] = None) -> List[Tuple[Tuple[int, int], Booking]]:
+        """
+        Return journal bookings that were never cancelled and ended at or before
+        `before`, optionally filtered by plate, in journal order.
+        """
+        booked = {}
+        for etype, key, b in self._read_events():
+            if plate is not None and b.plate != plate:
                 continue
-    return reservations
+            if etype == "BOOKING":
+                booked[(key, b)] = None
+            elif etype == "CANCEL":
+                booked.pop((key, b), None)
+        return [(key, b) for key, b in booked if b.end <= before]
+
+
+# Default journal (LOG_FILE) and module-level shortcuts to it
+journal = Journal(LOG_FILE, logger)
+log_booking = journal.log_booking
+log_cancellation = journal.log_cancellation
+replay_reservations = journal.replay_reservations
+cancelled_reservations = journal.cancelled_reservations
+archived_reservations = journal.archived_reservations
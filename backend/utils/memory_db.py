@@ -0,0 +1,130 @@
+# utils/memory_db.py
+"""
+In-memory stand-in for the subset of Motor used by this app, selected
+with MONGO_URI=memory://. Meant for load tests and offline runs: data
+lives in the process and is lost on exit.
+"""
+import asyncio
+import copy
+import itertools
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+_ids = itertools.count(1)
+
+
+def _matches(doc: dict, flt: dict) -> bool:
+    for k, v in flt.items():
+        if isinstance(v, dict) and "$in" in v:
+            if doc.get(k) not in v["$in"]:
+                return False
+        elif doc.get(k) != v:
+            return False
+    return True
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    include = [k for k, v in projection.items() if v and k != "_id"]
+    out = {k: copy.deepcopy(doc[k]) for k in include if k in doc} if include else copy.deepcopy(doc)
+    if projection.get("_id", 1) == 0:
+        out.pop("_id", None)
+    elif "_id" in doc:
+        out["_id"] = doc["_id"]
+    return out
+
+
+def _apply_update(doc: dict, update: dict) -> None:
+    for k, v in update.get("$set", {}).items():
+        doc[k] = copy.deepcopy(v)
+    for k, v in update.get("$inc", {}).items():
+        doc[k] = doc.get(k, 0) + v
+    for k in update.get("$unset", {}):
+        doc.pop(k, None)
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[dict]):
+        self._docs = docs
+
+    def sort(self, key: str, direction: int = 1) -> "MemoryCursor":
+        self._docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        await asyncio.sleep(0)
+        return self._docs if length is None else self._docs[:length]
+
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+
+    async def find_one(self, flt: Optional[dict] = None, projection: Optional[dict] = None):
+        await asyncio.sleep(0)
+        for doc in self._docs.values():
+            if _matches(doc, flt or {}):
+                return _project(doc, projection)
+        return None
+
+    def find(self, flt: Optional[dict] = None, projection: Optional[dict] = None) -> MemoryCursor:
+        return MemoryCursor([_project(d, projection) for d in self._docs.values()
+                             if _matches(d, flt or {})])
+
+    async def insert_one(self, doc: dict):
+        await asyncio.sleep(0)
+        doc.setdefault("_id", next(_ids))
+        self._docs[doc["_id"]] = copy.deepcopy(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def update_one(self, flt: dict, update: dict, upsert: bool = False):
+        await asyncio.sleep(0)
+        for doc in self._docs.values():
+            if _matches(doc, flt):
+                _apply_update(doc, update)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        doc = {k: v for k, v in flt.items() if not isinstance(v, dict)}
+        doc.update(copy.deepcopy(update.get("$setOnInsert", {})))
+        _apply_update(doc, update)
+        doc["_id"] = next(_ids)
+        self._docs[doc["_id"]] = doc
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+
+    async def delete_one(self, flt: dict):
+        await asyncio.sleep(0)
+        for key, doc in self._docs.items():
+            if _matches(doc, flt):
+                del self._docs[key]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        # UpdateOne only; reads the operation's filter and update document
+        matched = 0
+        for op in requests:
+            res = await self.update_one(op._filter, op._doc, upsert=bool(op._upsert))
+            matched += res.matched_count
+        return SimpleNamespace(matched_count=matched, modified_count=matched)
+
+    async def count_documents(self, flt: dict) -> int:
+        await asyncio.sleep(0)
+        return sum(1 for d in self._docs.values() if _matches(d, flt))
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
@@ -1,7 +1,6 @@
 # backend/utils/mongo.py
 
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
 load_dotenv()  # loads MONGO_URI and optional MONGO_DB
@@ -10,16 +9,23 @@ MONGO_URI = os.getenv("MONGO_URI")
 if not MONGO_URI:
     raise RuntimeError("MONGO_URI must be set in .env")
 
-# Create the client
-_client = AsyncIOMotorClient(MONGO_URI)
+if MONGO_URI == "memory://":
+    # In-process stand-in for load tests and offline runs
+    from utils.memory_db import MemoryDatabase
+    _default_db = MemoryDatabase()
+else:
+    from motor.motor_asyncio import AsyncIOMotorClient
 
-# Try to get a default database from the URI
-_default_db = _client.get_default_database()
+    # Create the client
+    _client = AsyncIOMotorClient(MONGO_URI)
 
-# If URI did not include a database, fall back to MONGO_DB or "park_and_ride"
-if _default_db is None:
-    db_name = os.getenv("MONGO_DB", "park_and_ride")
-    _default_db = _client[db_name]
+    # Try to get a default database from the URI
+    _default_db = _client.get_default_database()
+
+    # If URI did not include a database, fall back to MONGO_DB or "park_and_ride"
+    if _default_db is None:
+        db_name = os.getenv("MONGO_DB", "park_and_ride")
+        _default_db = _client[db_name]
 
 def get_db():
     """
@@ -40,7 +40,10 @@ export default function SubscribePage() {
         `${API_URL}/subscriptions/create-checkout-session`,
         {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: {
+            "Content-Type": "application/json",
+            Authorization: `Bearer ${localStorage.getItem("token")}`,
+          },
           body: JSON.stringify({ plate }),
         }
       );